@@ -0,0 +1 @@
+# Benchmarks of organize.py, remdup.py and the organize package
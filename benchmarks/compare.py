@@ -0,0 +1,27 @@
+# Compares two benchmark results written by benchmarks.run
+
+import sys
+import json
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares benchmark results')
+    parser.add_argument('before', type=str)
+    parser.add_argument('after', type=str)
+    args = parser.parse_args()
+
+    with open(args.before, 'rt') as f:
+        before = json.load(f)
+    with open(args.after, 'rt') as f:
+        after = json.load(f)
+
+    print('%-16s %10s %10s %8s' % ('stage', 'before', 'after', 'change'))
+    for name, stage in after['stages'].items():
+        if name not in before['stages']:
+            continue
+        old, new = before['stages'][name]['seconds'], stage['seconds']
+        change = (new - old) / old * 100 if old else 0
+        print('%-16s %9.3fs %9.3fs %+7.1f%%' % (name, old, new, change))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# Synthetic photo corpus
+#
+# Generates the same set of files for the same seed: JPEGs with and without
+# EXIF, file names in the styles get_datetime_from_filename recognizes,
+# dated folders, exact duplicates, resized near duplicates and fake MP4s.
+
+import os
+import sys
+import shutil
+import random
+import struct
+import argparse
+from datetime import datetime as dt, timedelta
+
+from PIL import Image, ImageDraw
+
+CAMERAS = [('Canon', 'Canon EOS-1Ds Mark III'),
+           ('Xiaomi', 'Redmi Note 7'),
+           ('LG Electronics', 'LG-H845'),
+           ('Apple', 'iPhone')]
+
+# Seconds between 1904-01-01 (QuickTime epoch) and 1970-01-01
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+def get_filename(rng, d, index):
+    # Returns a name in one of the styles organize.py recognizes
+    styles = ['IMG_%Y%m%d_%H%M%S.jpg',
+              '%Y%m%d_%H%M%S.jpg',
+              '%Y%m%d_%H%M%S_HDR.jpg',
+              'PANO_%Y%m%d_%H%M%S.jpg',
+              '%Y-%m-%d_%H-%M-%S.jpg',
+              'IMG-%Y%m%d-WA{:04d}.jpg'.format(index % 10000),
+              'IMG_%Y%m%d_%H%M%S_HHT.jpg',
+              None]
+    style = rng.choice(styles)
+    if style is None:
+        return '%d.jpg' % (int(d.timestamp()) * 1000 + rng.randint(0, 999))
+    return d.strftime(style)
+
+def make_image(rng, width, height):
+    image = Image.new('RGB', (width, height), tuple(rng.randint(0, 255) for i in range(3)))
+    draw = ImageDraw.Draw(image)
+    for i in range(rng.randint(3, 12)):
+        x1, y1 = rng.randint(0, width - 1), rng.randint(0, height - 1)
+        x2, y2 = rng.randint(x1, width), rng.randint(y1, height)
+        draw.rectangle((x1, y1, x2, y2), fill=tuple(rng.randint(0, 255) for i in range(3)))
+    return image
+
+def make_exif(rng, d):
+    exif = Image.Exif()
+    make, model = rng.choice(CAMERAS)
+    exif[0x010f] = make
+    exif[0x0110] = model
+    exif[0x0132] = d.strftime('%Y:%m:%d %H:%M:%S')
+    exif.get_ifd(0x8769)[0x9003] = d.strftime('%Y:%m:%d %H:%M:%S')
+    return exif
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+def make_mp4(rng, d, size):
+    # ftyp, moov/mvhd with the creation time and mdat with random bytes
+    created = int(d.timestamp()) + QUICKTIME_EPOCH_OFFSET
+    mvhd = struct.pack('>B3xIIII', 0, created, created, 1000, rng.randint(1000, 60000))
+    mvhd += b'\0' * 80
+    return box(b'ftyp', b'isom\0\0\x02\0isomiso2mp41') + \
+           box(b'moov', box(b'mvhd', mvhd)) + \
+           box(b'mdat', bytes(rng.getrandbits(8) for i in range(size)))
+
+def generate(path, count=200, seed=1, min_size=320, max_size=1600):
+    # Generates about count files under path/src, returns list of them
+    rng = random.Random(seed)
+    start = dt(2016, 1, 1)
+    files = []
+    src = os.path.join(path, 'src')
+    os.makedirs(src, exist_ok=True)
+
+    for i in range(count):
+        d = start + timedelta(seconds=rng.randint(0, 4 * 365 * 24 * 3600))
+        kind = rng.random()
+
+        if kind < 0.05:
+            filename = os.path.join(src, d.strftime('VID_%Y%m%d_%H%M%S.mp4')
+                                    if rng.random() < 0.5 else 'clip_%04d.mp4' % i)
+            with open(filename, 'wb') as f:
+                f.write(make_mp4(rng, d, rng.randint(10000, 100000)))
+            files.append(filename)
+            continue
+
+        width = rng.randint(min_size, max_size)
+        height = rng.randint(min_size, max_size)
+        image = make_image(rng, width, height)
+
+        if kind < 0.15:
+            # Date only in the folder name
+            folder = os.path.join(src, d.strftime('%Y-%m-%d trip'))
+            os.makedirs(folder, exist_ok=True)
+            filename = os.path.join(folder, 'DSC%05d.jpg' % i)
+        elif kind < 0.5:
+            # EXIF only
+            filename = os.path.join(src, 'DSC%05d.jpg' % i)
+        else:
+            filename = os.path.join(src, get_filename(rng, d, i))
+
+        if os.path.exists(filename):
+            continue
+
+        if kind < 0.5 or rng.random() < 0.3:
+            image.save(filename, quality=90, exif=make_exif(rng, d).tobytes())
+        else:
+            image.save(filename, quality=90)
+        files.append(filename)
+
+        if rng.random() < 0.1:
+            # Exact duplicate
+            copy = os.path.join(src, 'copy_%05d.jpg' % i)
+            shutil.copyfile(filename, copy)
+            files.append(copy)
+        if rng.random() < 0.1:
+            # Resized and re-encoded near duplicate
+            near = os.path.join(src, 'resized_%05d.jpg' % i)
+            image.resize((width // 2, height // 2)).save(near, quality=75)
+            files.append(near)
+
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates synthetic photo corpus')
+    parser.add_argument('path', type=str, help='Output directory')
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    files = generate(args.path, args.count, args.seed)
+    print("Generated %d files in %s" % (len(files), args.path))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+# Benchmark runner
+#
+# Generates a corpus (or uses an existing one), times every stage of the
+# pipeline separately and writes results as JSON, so they can be compared
+# between commits:
+#
+#   python -m benchmarks.run --output before.json
+#   python -m benchmarks.compare before.json after.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from benchmarks.corpus import generate
+from organize.cli import load_script
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def get_app():
+    module = load_script('organize')
+    args = argparse.Namespace(src=None, dst=None, test=True, date_rules=None, classify=False,
+                              classify_rules=None)
+    return module, module.App(args)
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(func, items, repeat):
+    # Returns the best wall time of calling func for every item
+    best = None
+    for i in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def ignore_errors(func):
+    def wrapper(item):
+        try:
+            func(item)
+        except Exception:
+            pass
+    return wrapper
+
+def bench_duplicates(files, workdir, near):
+    from organize.hash_index import HashIndex
+    from organize.dedupe import find_duplicates
+
+    filename = os.path.join(workdir, 'index.sqlite')
+    if os.path.exists(filename):
+        os.remove(filename)
+    index = HashIndex(filename)
+    half = len(files) // 2
+    started = time.perf_counter()
+    find_duplicates(files[:half], files[half:], index, near, near and 4 or 0)
+    elapsed = time.perf_counter() - started
+    index.close()
+    return elapsed
+
+def bench_end_to_end(src, workdir):
+    dst = os.path.join(workdir, 'dst')
+    os.makedirs(dst, exist_ok=True)
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'organize.py'), '--src', src,
+                    '--dst', dst, '--test'], cwd=workdir, check=True,
+                   env=dict(os.environ, HOME=workdir),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+def run(corpus, files, repeat):
+    from organize.pcp_hash import get_file_hash, calculate_pcp_hash
+
+    module, app = get_app()
+    images = [f for f in files if f.lower().endswith('.jpg')]
+    stages = {}
+
+    def add(name, seconds, count):
+        stages[name] = {'seconds': seconds, 'files': count,
+                        'ms_per_file': seconds * 1000 / count if count else None}
+
+    add('exif', measure(app.get_exif, files, repeat), len(files))
+    add('filename', measure(ignore_errors(app.get_datetime_from_filename), files, repeat),
+        len(files))
+    add('md5', measure(get_file_hash, files, repeat), len(files))
+    add('pcp_hash', measure(calculate_pcp_hash, images, repeat), len(images))
+
+    workdir = tempfile.mkdtemp(prefix='organize-bench-')
+    try:
+        add('duplicates', bench_duplicates(files, workdir, False), len(files))
+        add('near_duplicates', bench_duplicates(images, workdir, True), len(images))
+        add('end_to_end_test', bench_end_to_end(os.path.join(corpus, 'src'), workdir),
+            len(files))
+    finally:
+        shutil.rmtree(workdir)
+
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs benchmarks')
+    parser.add_argument('--corpus', type=str, help='Corpus directory, generated if missing')
+    parser.add_argument('--count', type=int, default=200, help='Number of generated files')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='Best of N runs is reported')
+    parser.add_argument('--output', type=str, help='JSON file for the results')
+    args = parser.parse_args()
+
+    # Errors about unreadable files are expected
+    logging.getLogger('organize').addHandler(logging.NullHandler())
+
+    corpus = args.corpus or tempfile.mkdtemp(prefix='organize-corpus-')
+    try:
+        src = os.path.join(corpus, 'src')
+        if not os.path.exists(src):
+            generate(corpus, args.count, args.seed)
+        files = sorted(os.path.join(root, f) for root, dirs, names in os.walk(src) for f in names)
+
+        results = {'commit': get_commit(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'corpus': {'count': args.count, 'seed': args.seed, 'files': len(files)},
+                   'repeat': args.repeat,
+                   'stages': run(corpus, files, args.repeat)}
+    finally:
+        if args.corpus is None:
+            shutil.rmtree(corpus)
+
+    for name, stage in results['stages'].items():
+        print('%-16s %8.3f s %8.3f ms/file' % (name, stage['seconds'], stage['ms_per_file'] or 0))
+
+    if args.output is not None:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    sys.exit(main())
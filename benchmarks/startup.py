@@ -0,0 +1,86 @@
+# Startup time benchmark
+#
+# The tools are started for every uploaded file, so their cold start
+# matters as much as throughput. Every command is run a number of times
+# on trivial input and the median wall time above a bare interpreter is
+# compared with a budget, the exit code is 1 if it's exceeded:
+#
+#   python -m benchmarks.startup --budget 0.15 --output startup.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds a command may take on top of the interpreter startup
+DEFAULT_BUDGET = 0.15
+
+def get_commands(workdir):
+    empty = os.path.join(workdir, 'empty')
+    os.makedirs(empty, exist_ok=True)
+    video = os.path.join(workdir, 'clip.mp4')
+    with open(video, 'wb') as f:
+        f.write(b'\0' * 1024)
+
+    def script(name, *args):
+        return [sys.executable, os.path.join(ROOT, '%s.py' % name)] + list(args)
+
+    return {
+        'organize': script('organize', '--src', empty, '--dst', empty, '--test'),
+        'hash': script('hash', video),
+        'remdup': script('remdup', '--src', empty, '--dst', empty),
+        'cli': [sys.executable, '-m', 'organize', 'hash', video],
+    }
+
+def measure(command, workdir, repeat):
+    # Returns median wall time of running command
+    env = dict(os.environ, HOME=workdir)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    times = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=workdir, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures startup time of the tools')
+    parser.add_argument('--repeat', type=int, default=10, help='Median of N runs is reported')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='Seconds a command may take above a bare interpreter')
+    parser.add_argument('--output', type=str, help='JSON file for the results')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='organize-startup-')
+    try:
+        baseline = measure([sys.executable, '-c', 'pass'], workdir, args.repeat)
+        results = {'python': baseline, 'budget': args.budget, 'commands': {}}
+        for name, command in get_commands(workdir).items():
+            results['commands'][name] = measure(command, workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    print('%-10s %8.3f s' % ('python', baseline))
+    exceeded = False
+    for name, seconds in results['commands'].items():
+        overhead = seconds - baseline
+        status = 'ok' if overhead <= args.budget else 'OVER BUDGET'
+        exceeded = exceeded or overhead > args.budget
+        print('%-10s %8.3f s  +%.3f s  %s' % (name, seconds, overhead, status))
+
+    if args.output is not None:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if exceeded else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
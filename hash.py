@@ -1,14 +1,144 @@
 #!/usr/bin/env python3
 
+"""
+Prints md5 and perceptual hashes of files.
+
+With a single file prints both hashes of it. Otherwise hashes every file
+given, directories are scanned recursively, and writes a JSON line with
+path, size, md5 and pcp of every file as soon as it's hashed. Hashes known
+to the hash index are not calculated again.
+"""
+
+import os
 import sys
+import json
+import argparse
+
+from organize.pcp_hash import get_file_hash, get_pcp_hash, calculate_pcp_hash
+from organize.hash_index import get_index
+from organize.walker import walk
+from organize.video import is_video
+
+# Number of files looked up in the index at once
+BATCH_SIZE = 1024
+
+# Number of files sent to a worker process at once
+CHUNK_SIZE = 16
+
+def hash_file(filename):
+    # Returns JSON record of a file and its stat taken before it was hashed,
+    # runs in worker processes. The md5 is stored under that stat, so if the
+    # file changes while it's hashed the md5 isn't taken for the new content.
+    try:
+        st = os.stat(filename)
+        md5 = get_file_hash(filename)
+    except OSError as e:
+        return {'path': filename, 'error': str(e)}, None
+    # Videos have no perceptual hash, Pillow isn't even imported for them
+    pcp = None if is_video(filename) else calculate_pcp_hash(filename)
+    return {'path': filename, 'size': st.st_size, 'md5': md5, 'pcp': pcp}, st
+
+class App():
+
+    def __init__(self):
+        parser = argparse.ArgumentParser(description='File hashing tool')
+        parser.add_argument('paths', nargs='*', help='Files and directories')
+        parser.add_argument('-0', '--null', action='store_true', default=False,
+                            help='Reads NUL separated paths from stdin')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Number of processes hashing files')
+        self.args = parser.parse_args()
+
+        if not self.args.paths and not self.args.null:
+            parser.error('no files given')
+
+    def get_stdin_paths(self):
+        # Reads paths one by one, the list may be endless
+        pending = b''
+        while True:
+            data = sys.stdin.buffer.read1(65536)
+            if not data:
+                break
+            *paths, pending = (pending + data).split(b'\0')
+            for path in paths:
+                if path:
+                    yield os.fsdecode(path)
+        if pending:
+            yield os.fsdecode(pending)
+
+    def get_files(self):
+        paths = self.args.paths
+        if self.args.null:
+            paths = self.get_stdin_paths()
+        for path in paths:
+            if os.path.isdir(path):
+                for entry in walk(path):
+                    yield entry.path
+            else:
+                yield path
+
+    def get_batches(self):
+        batch = []
+        for filename in self.get_files():
+            batch.append(filename)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def hash_batch(self, batch, pool):
+        # Yields records of files of batch, the ones known to the index first
+        md5s = self.index.lookup_many(batch)
+        pcps = self.index.lookup_pcp_many(md5s.values())
+
+        todo = []
+        for filename in batch:
+            md5 = md5s.get(filename)
+            if md5 is not None and md5 in pcps:
+                yield {'path': filename, 'size': os.path.getsize(filename), 'md5': md5,
+                       'pcp': pcps[md5]}
+            else:
+                todo.append(filename)
+
+        if pool is not None:
+            results = pool.imap_unordered(hash_file, todo, CHUNK_SIZE)
+        else:
+            results = map(hash_file, todo)
+
+        for record, st in results:
+            if st is not None:
+                self.index.store_md5(record['path'], record['md5'], st)
+                if record['pcp'] is not None:
+                    self.index.store_pcp_many([(record['md5'], record['pcp'])])
+            yield record
 
-from organize.pcp_hash import get_file_hash, get_pcp_hash
+    def run(self):
+        if len(self.args.paths) == 1 and not self.args.null and \
+                not os.path.isdir(self.args.paths[0]):
+            filename = self.args.paths[0]
+            print("md5_hash: %s" % get_file_hash(filename))
+            print("PCP hash: %s" % (None if is_video(filename) else get_pcp_hash(filename)))
+            return 0
 
-if len(sys.argv) != 2:
-    print("Usage: hash.py filename")
-    sys.exit(2)
+        self.index = get_index()
+        pool = None
+        if self.args.jobs > 1:
+            import multiprocessing
 
-filename = sys.argv[1]
+            pool = multiprocessing.Pool(self.args.jobs)
+        failed = False
+        try:
+            for batch in self.get_batches():
+                for record in self.hash_batch(batch, pool):
+                    failed = failed or 'error' in record
+                    sys.stdout.write(json.dumps(record) + '\n')
+                sys.stdout.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+        return 1 if failed else 0
 
-print("md5_hash: %s" % get_file_hash(filename))
-print("PCP hash: %s" % get_pcp_hash(filename))
+if __name__ == '__main__':
+    app = App()
+    sys.exit(app.run())
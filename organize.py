@@ -10,22 +10,32 @@ organize.py never overwrites existing files in --dst
 import os
 import re
 import sys
-import shutil
+import atexit
 import logging
-from logging import FileHandler
 import argparse
-import datetime
-from hashlib import md5 as md5_hash
-from datetime import datetime as dt
-from calendar import monthrange
-
-from PIL import Image, ExifTags
-from PIL.ExifTags import TAGS, GPSTAGS
-from PIL.JpegImagePlugin import JpegImageFile
-
-from organize.pcp_hash import get_file_hash, get_pcp_hash, get_file_size
+from datetime import datetime as dt, timedelta
+
+# Pillow, multiprocessing, cProfile and the watcher are imported where
+# they are used, most runs don't need all of them
+
+from organize.cli import setup_logging
+from organize.pcp_hash import get_file_hash
+from organize.hash_index import get_index
+from organize.exif import read_jpeg_header
+from organize.hamming import hamming_distance
+from organize.journal import Journal
+from organize.datematch import get_matcher, EPOCH_MS
+from organize.plan import FileActions, PlannedActions, apply_plan
+from organize.namespace import DestinationIndex
+from organize.stats import stats
+from organize.fileinfo import FileInfo
+from organize.video import is_video, read_creation_time
+from organize.walker import walk
+from organize.content_index import ContentIndex
+from organize.classify import get_classifier
 
 EXCLUDE_EXIF = ['MakerNote', 'UserComment']
+ALLOWED_EXTENSIONS = ('jpg', 'jpeg', 'mov', 'mp4', 'webm', '3gp')
 MAPPING = {'Xiaomi Redmi Note 7': 'Xiaomi', 'LG Electronics LG-H845': 'LG G5',
            'Apple iPhone': 'iPhone',
            'Apple TIFFMODEL_IPHONE': 'iPhone',
@@ -37,6 +47,9 @@ MAPPING = {'Xiaomi Redmi Note 7': 'Xiaomi', 'LG Electronics LG-H845': 'LG G5',
            'OLYMPUS OPTICAL CO.,LTD C120,D380': 'Olympus C120',
            '2006-04-01 - 2006-04-30 - CASIO COMPUTER CO.,LTD  EX-S100': 'Casio EX-S100'}
 
+# Number of files sent to a worker process at once
+CHUNK_SIZE = 16
+
 logger = logging.getLogger("organize")
 
 class FileProcessException(Exception):
@@ -44,29 +57,99 @@ class FileProcessException(Exception):
 
 class App():
 
-    def __init__(self):
-        self.setup_logging()
+    def __init__(self, args=None):
+        self.folder_dates = {}
+
+        if args is not None:
+            # Worker process, arguments are already parsed and checked
+            self.args = args
+            self.matcher = get_matcher(self.args.date_rules)
+            self.setup_classifier()
+            self.index = None
+            return
+
+        setup_logging()
         parser = argparse.ArgumentParser(description='Image organize tool')
         parser.add_argument('--src', type=str, help='Path', required=False)
         parser.add_argument('--dst', type=str, help='Destination', required=False)
         parser.add_argument('--test', action='store_true', default=False)
         parser.add_argument('--file', type=str, help='Processes only a given file in debug mode')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='Number of processes extracting metadata')
+        parser.add_argument('--max-distance', type=int, default=0,
+                            help='Maximum number of different bits of perceptual hashes of '
+                                 'images considered equal')
+        parser.add_argument('--incremental', action='store_true', default=False,
+                            help='Skips directories and files unchanged since previous runs')
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help='Continues the last interrupted run')
+        parser.add_argument('--watch', action='store_true', default=False,
+                            help='Keeps running and processes new files as they arrive')
+        parser.add_argument('--settle-time', type=float,
+                            help='Seconds a new file should stay unchanged before processing, '
+                                 '2 by default')
+        parser.add_argument('--polling', action='store_true', default=False,
+                            help='Polls --src for changes instead of using inotify')
+        parser.add_argument('--date-rules', type=str,
+                            help='JSON file with additional file and folder name rules')
+        parser.add_argument('--classify', action='store_true', default=False,
+                            help='Moves screenshots, square images and PNGs to their own folders')
+        parser.add_argument('--classify-rules', type=str,
+                            help='JSON file with classification rules to use instead of '
+                                 'the built-in ones, implies --classify')
+        parser.add_argument('--plan', type=str,
+                            help='Writes planned operations to a JSONL file instead of doing them')
+        parser.add_argument('--apply', type=str, help='Applies operations planned with --plan')
+        parser.add_argument('--rescan-dst', action='store_true', default=False,
+                            help='Indexes files added to --dst by other tools')
+        parser.add_argument('--profile', action='store_true', default=False,
+                            help='Prints time spent in every stage at exit')
+        parser.add_argument('--profile-json', type=str,
+                            help='Writes the --profile report to a JSON file')
+        parser.add_argument('--cprofile', type=str,
+                            help='Runs --file under cProfile and writes its stats to a file')
         self.args = parser.parse_args()
 
-        self.args.src = os.path.expanduser(self.args.src)
-        self.args.dst = os.path.expanduser(self.args.dst)        
+        if self.args.plan is not None and self.args.watch:
+            parser.error('--plan can not be used with --watch')
+        if self.args.cprofile is not None and self.args.file is None:
+            parser.error('--cprofile can only be used with --file')
+
+        stats.enabled = self.args.profile or self.args.profile_json is not None
+
+        if self.args.src is not None:
+            self.args.src = os.path.expanduser(self.args.src)
+        if self.args.dst is not None:
+            self.args.dst = os.path.expanduser(self.args.dst)
 
         if self.args.dst is not None:
             if not os.path.exists(self.args.dst) or not os.path.isdir(self.args.dst):
                 raise Exception('Destination path does not exist')
 
-    def setup_logging(self):
-        logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                            level=logging.INFO, stream=sys.stdout)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler = FileHandler('organize-%s.log' % dt.now().strftime('%Y%m%d_%H%M%S'))
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        self.matcher = get_matcher(self.args.date_rules)
+        self.setup_classifier()
+        self.index = get_index()
+        self.journal = None
+        self.contents = None
+
+        namespace = DestinationIndex(self.args.dst)
+        if self.args.plan is not None:
+            self.actions = PlannedActions(namespace, self.args.plan)
+        else:
+            self.actions = FileActions(namespace)
+
+    def setup_classifier(self):
+        self.classifier = None
+        self.extensions = ALLOWED_EXTENSIONS
+        if self.args.classify or self.args.classify_rules is not None:
+            self.classifier = get_classifier(self.args.classify_rules, self.args.dst or '.')
+            # Formats the rules look for may not be photos
+            self.extensions += self.classifier.get_suffixes()
+
+    def setup_log_file(self):
+        # Only runs which may change files are logged to a file, and the
+        # file is created by the first message
+        setup_logging(log_file='organize-%s.log' % dt.now().strftime('%Y%m%d_%H%M%S'))
 
     def exif2text(self, value):
         """ Helper function """
@@ -106,64 +189,55 @@ class App():
 
         return d
 
-    def get_datetime_from_filename(self, filename):
-        basename = os.path.basename(filename)
-        # IMG_20160407_193522_HDR_1460046931206.jpg
-        expr_list = {'IMG_(\d{8}_\d{6}).(?:jpg|jpeg)': '%Y%m%d_%H%M%S',
-                     '(\d{8}_\d{6}).(?:jpg|jpeg)': '%Y%m%d_%H%M%S',
-                     '(\d{8}_\d{6})_HDR.(?:jpg|jpeg)': '%Y%m%d_%H%M%S',
-                     'IMG_(\d{8}_\d{6})_HDR_\d{13}.jpg': '%Y%m%d_%H%M%S',
-                     'PANO_(\d{8}_\d{6}).(?:jpg|jpeg)': '%Y%m%d_%H%M%S',
-                     '(?:VID|video)_(\d{8}_\d{6}).mp4': '%Y%m%d_%H%M%S',
-                     '(\d{8}_\d{6}).(mp4)': '%Y%m%d_%H%M%S',
-                     '(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}).jpg': '%Y-%m-%d_%H-%M-%S',
-                     'IMG\-(\d{8})-WA\d{4}.(?:jpg|jpeg)': '%Y%m%d',
-                     'IMG_(\d{8}_\d{6})_(.*)?\d{13}.jpg': '%Y%m%d_%H%M%S',
-                     'IMG_(\d{8}_\d{6})_HHT.jpg': '%Y%m%d_%H%M%S'
-                     }
-        folder_expr = {'(\d{4}-\d{2}-\d{2})': '%Y-%m-%d',
-                       '(\d{2}-\d{2}-\d{4})': '%d-%m-%Y',
-                       '(\d{2}\.\d{2}\.\d{2})': '%d.%m.%y'}
-
-        d = None
-
-        # Unix epoch
-        if re.match(r'^1(4|5)\d{11}\.(jpg|jpeg|mp4)$', basename):
-            m = re.search('^(\d+)\.', basename)
-            d = dt.fromtimestamp(int(m.group(1))/1000.0)
-            return d
-
-        for expr in expr_list.keys():
-            m = re.search(expr, basename)
+    def get_datetime_from_folder(self, folder):
+        # Returns (datetime, error), memoized since files of the same
+        # folder are usually processed one after another
+        if folder not in self.folder_dates:
+            result = (None, None)
+            m = self.matcher.match_folder(folder)
             if m is not None:
                 try:
-                    d = dt.strptime(m.group(1), expr_list[expr])
+                    result = (dt.strptime(*m), None)
                 except ValueError:
-                    raise FileProcessException("Invalid value for date and time in filename")
-                return d
+                    result = (None, "Invalid value for date in folder name")
+            self.folder_dates[folder] = result
+        return self.folder_dates[folder]
+
+    def get_datetime_from_filename(self, filename):
+        basename = os.path.basename(filename)
+
+        m = self.matcher.match(basename)
+        if m is not None:
+            value, format_ = m
+            if format_ == EPOCH_MS:
+                return dt.fromtimestamp(int(value)/1000.0)
+            try:
+                return dt.strptime(value, format_)
+            except ValueError:
+                raise FileProcessException("Invalid value for date and time in filename")
 
         # Last resort - try to detect date from parents folder name
-        if d is None and len(filename.split('/')) > 1:
+        if len(filename.split('/')) > 1:
             parent_folder = filename.split('/')[-2]
-            for expr in folder_expr.keys():
-                m = re.search(expr, parent_folder)
-                if m is not None:
-                    try:
-                        d = dt.strptime(m.group(1), folder_expr[expr])
-                        if d.year < 2001 or d.year > 2020:
-                            logger.error("Invalid year folder name: %s", parent_folder)
-                            return None
-                    except ValueError:
-                        raise FileProcessException("Invalid value for date in folder name")
-                    # Add date to the file name in order not to lose
-                    # date/time inforation
-                    logger.info("Got date and time from parent's folder name")
-                    return d
+            d, error = self.get_datetime_from_folder(parent_folder)
+            if error is not None:
+                raise FileProcessException(error)
+            if d is not None:
+                if d.year < 2001 or d.year > 2020:
+                    logger.error("Invalid year folder name: %s", parent_folder)
+                    return None
+                # Add date to the file name in order not to lose
+                # date/time inforation
+                logger.info("Got date and time from parent's folder name")
+                return d
 
-        return d
+        return None
 
     def get_datetime(self, filename, exif):
         date_ = self.get_datetime_from_exif(exif)
+        if date_ is None and is_video(filename):
+            # Videos keep creation time in the container instead of EXIF
+            date_ = read_creation_time(filename)
         if date_ is None:
             return self.get_datetime_from_filename(filename)
         else:
@@ -173,11 +247,30 @@ class App():
         return MAPPING.get(fullname, fullname)
 
     def get_time_interval(self, d):
-        i = '%s - %s' % (datetime.datetime(d.year, d.month, 1).strftime('%Y-%m-%d'),
-                         datetime.datetime(d.year, d.month, monthrange(d.year, d.month)[1]).strftime('%Y-%m-%d'))
-        return i
+        first = d.replace(day=1)
+        # The day before the first day of the next month
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return '%s - %s' % (first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'))
 
     def get_exif(self, filename):
+        return self.get_header(filename)[0]
+
+    def get_header(self, filename):
+        # Returns (EXIF, size), size is known for JPEGs only
+        if is_video(filename):
+            return {}, None
+        with stats.stage('exif'):
+            exif, size = read_jpeg_header(filename)
+            if exif is None:
+                # Not a JPEG or a broken one, let Pillow decide
+                return self.get_exif_pillow(filename), None
+            return exif, size
+
+    def get_exif_pillow(self, filename):
+        from PIL import Image
+        from PIL.ExifTags import TAGS
+        from PIL.JpegImagePlugin import JpegImageFile
+
         try:
             image = Image.open(filename)
         except Exception:
@@ -199,14 +292,23 @@ class App():
         return exif
 
     def filter(self, filename):
-        allowed_extensions = ['jpg', 'jpeg', 'mov', 'mp4', 'webm', '3gp']
-        return any(filename.lower().endswith(i) for i in allowed_extensions)
+        return filename.lower().endswith(self.extensions)
+
+    def get_filter_key(self):
+        # The journal redoes what runs with other extensions or
+        # classification rules have done
+        key = ','.join(sorted(set(self.extensions)))
+        if self.classifier is not None:
+            key += ';classify=%s' % (self.args.classify_rules or '')
+        return key
 
     def get_next_file(self):
-        for root, dirs, files in os.walk(self.args.src):
-            for file in files:
-                if self.filter(os.path.join(root, file)):
-                    yield os.path.join(root, file)
+        if self.journal is not None:
+            yield from self.journal.walk(self.args.src, self.filter)
+            return
+
+        for entry in walk(self.args.src, self.extensions):
+            yield entry.path
 
     def get_make(self, exif):
         return exif.get('Make') or exif.get('Camera make')
@@ -214,75 +316,125 @@ class App():
     def get_model(self, exif):
         return exif.get('Model') or exif.get('Camera model')
 
+    def get_file_hash(self, filename, st=None):
+        if self.index is None:
+            # Worker process, the index belongs to the main one
+            return get_file_hash(filename)
+        return self.index.get_file_hash(filename, st)
+
+    def get_pcp_hash(self, filename, md5=None):
+        return self.index.get_pcp_hash(filename, md5)
+
+    def get_contents(self):
+        # Returns ContentIndex of the destination, it's opened on first use
+        # since the first use of a destination scans it
+        if self.contents is None:
+            self.contents = ContentIndex(self.args.dst, self.get_file_hash, ALLOWED_EXTENSIONS)
+            atexit.register(self.contents.close)
+        return self.contents
+
+    def import_file(self, info, dst):
+        md5 = info.md5 if info.has_md5() else None
+        dst = self.actions.move(info.filename, dst)
+        if self.args.plan is None:
+            self.get_contents().add(dst, md5)
+        else:
+            # Planned moves are kept in memory, they are written to the
+            # index when the plan is applied
+            self.get_contents().add_planned(dst, info.filename, info.file_size, md5)
+
+    def remove_from_dst(self, dst):
+        self.actions.remove(dst)
+        if self.args.plan is None:
+            self.get_contents().discard(dst)
+        else:
+            self.get_contents().discard_planned(dst)
+
     def get_remove_candidate(self, file1, file2):
-        # Determines which file to delete based on file contents
-        logger.info("Choosing remove candidate between \"%s\" and \"%s\"", file1, file2)
+        # Determines which file to delete based on file contents, gets and
+        # returns FileInfo objects
+        logger.info("Choosing remove candidate between \"%s\" and \"%s\"", file1.filename,
+                    file2.filename)
 
-        os.system("jhead -q -autorot \"%s\"" % file1)
-        os.system("jhead -q -autorot \"%s\"" % file2)
+        pcp_hash1 = file1.pcp_hash
+        pcp_hash2 = file2.pcp_hash
 
-        pcp_hash1 = get_pcp_hash(file1)
-        pcp_hash2 = get_pcp_hash(file2)
+        if pcp_hash1 is None or pcp_hash2 is None:
+            logger.info("Could not get PCP hash, keeping both")
+            return None
+
+        distance = hamming_distance(pcp_hash1, pcp_hash2)
 
-        if pcp_hash1 != pcp_hash2:
+        if distance > self.args.max_distance:
             logger.info("Files have different PCP hashes, keeping both (%s != %s)", pcp_hash1,
                         pcp_hash2)
             return None
 
-        if pcp_hash1 == '0000000000000000':
+        if int(pcp_hash1, 16) == 0:
             return None
 
-        logger.info("Files PCP hashes are equal: %s", pcp_hash1)
+        logger.info("Files PCP hashes are equal: %s (distance %d)", pcp_hash1, distance)
         # If images are equal, we keep the best one
-        im1 = Image.open(file1)
-        im2 = Image.open(file2)
-        w1, h1 = im1.size
-        w2, h2 = im2.size
+        w1, h1 = file1.size
+        w2, h2 = file2.size
 
         if w1/h1 != w2/h2:
             logger.warning("Images proportions are differ")
             return None
 
-        if w1*h1 > w2*h2 and self.get_exif(file1) != {}:
+        if w1*h1 > w2*h2 and file1.exif != {}:
             logger.info('file1 is larger and contains EXIF')
             return file2
-        elif w2*h2 > w1*h1 and self.get_exif(file2) != {}:
+        elif w2*h2 > w1*h1 and file2.exif != {}:
             logger.info('file2 is larger and contains EXIF')
             return file1
-        elif w1*h1 == w2*h2 and self.get_exif(file1) != {} and self.get_exif(file2) != {}:
+        elif w1*h1 == w2*h2 and file1.exif != {} and file2.exif != {}:
             logger.info("Images have the same geometry, comparing file sizes")
-            if get_file_size(file1) > get_file_size(file2):
+            if file1.file_size > file2.file_size:
                 return file2
             else:
                 return file1
         else:
             return None
 
-    def move_file(self, src, dst):
-        if not os.path.exists(dst):
+    def move_file(self, info, dst):
+        # info is FileInfo of the source file
+        src = info.filename
+
+        # The same file may be anywhere in dst, not only under the same name
+        duplicate = self.get_contents().find_duplicate(info)
+        if duplicate is not None and self.actions.exists(duplicate):
+            logger.info("%s is already in destination as %s", src, duplicate)
+            self.actions.remove(src)
+            return
+
+        if not self.actions.exists(dst):
             # If dst doesn't exist just move src to dst
-            logger.info('MV %s -> %s', src, dst)
-            shutil.move(src, dst)
-        elif get_file_hash(src) == get_file_hash(dst):
+            self.import_file(info, dst)
+            return
+
+        # dst may be a file that is only planned to be moved there
+        dst_info = FileInfo(self.actions.physical(dst), self)
+
+        if info.md5 == dst_info.md5:
             # If it exists and it's the same file - remove src
-            logger.info('RM %s' % src)
-            os.remove(src)
+            self.actions.remove(src)
         else:
             # If both are exist and differ - check their perceptual hashes
             # and sizes, maybe we can determine which one is better, if not -
             # we move with a different name
-            remove = self.get_remove_candidate(src, dst)
+            remove = self.get_remove_candidate(info, dst_info)
 
             if remove is not None:
                 logger.warning("Removing duplicate image")
-                logger.warning("RM %s", remove)
-                os.remove(remove)
-                if remove == dst:
-                    logger.info('MV %s -> %s', src, dst)
-                    shutil.move(src, dst)    
+                if remove is dst_info:
+                    self.remove_from_dst(dst)
+                    self.import_file(info, dst)
+                else:
+                    self.actions.remove(src)
             else:
                 # Move it with a different name
-                safe_move(src, dst)
+                self.import_file(info, self.actions.get_free_filename(dst))
 
     def get_path_description(self, filename, exif):
         if self.get_make(exif) is not None and self.get_model(exif) is not None:
@@ -311,15 +463,24 @@ class App():
 
         return '%s_%s.%s' % (datetime.strftime('%Y%m%d'), time_part, ext)
 
-    def process_file(self, filename):
+    def get_target(self, info):
+        # Returns full destination filename, doesn't touch the destination
+        filename = info.filename
         logger.info("Processing file %s", filename)
-        exif = self.get_exif(filename)
+
+        if self.classifier is not None:
+            target = self.classifier.classify(info)
+            if target is not None:
+                return target
+
+        exif = info.exif
         logger.debug(exif)
-        datetime = self.get_datetime(filename, exif)
+        with stats.stage('datetime'):
+            datetime = self.get_datetime(filename, exif)
 
         if datetime is None:
             logger.error("Could not get date and time for file %s", filename)
-            return
+            return None
 
         basename = self.get_new_basename(datetime, filename)
 
@@ -331,31 +492,175 @@ class App():
         else:
             dst_path = time_interval
 
-        dst_full_path = os.path.join(self.args.dst, datetime.strftime('%Y'), dst_path)
+        return os.path.join(self.args.dst, datetime.strftime('%Y'), dst_path, basename)
+
+    def place_file(self, info, target):
+        dst_full_path = os.path.dirname(target)
 
-        if not os.path.exists(dst_full_path) and not self.args.test:
-            os.makedirs(dst_full_path)
         if not self.args.test:
-            self.move_file(filename, os.path.join(dst_full_path, basename))
+            self.actions.makedirs(dst_full_path)
+            self.move_file(info, target)
         else:
-            logger.info('%s -> %s' % (filename, os.path.join(dst_full_path, basename)))
+            logger.info('%s -> %s' % (info.filename, target))
+
+    def process_file(self, filename):
+        info = FileInfo(filename, self)
+        target = self.get_target(info)
+        if target is not None:
+            self.place_file(info, target)
+        return target
+
+    def file_done(self, filename, failed):
+        if self.journal is not None:
+            self.journal.done(filename, failed)
+
+    def get_targets(self):
+        # Yields (FileInfo, target, error, stats) in the same order as
+        # get_next_file() does, metadata is extracted by a pool of processes
+        import multiprocessing
+
+        with multiprocessing.Pool(self.args.jobs, init_worker, (self.args,)) as pool:
+            yield from pool.imap(process_worker, self.get_next_file(), CHUNK_SIZE)
 
     def run(self):
         if self.args.file is not None:
             logger.setLevel(logging.DEBUG)
             self.args.test = True
             self.args.dst = '.'
-            self.process_file(self.args.file)
+            if self.args.cprofile is not None:
+                import cProfile
+
+                profile = cProfile.Profile()
+                profile.runcall(self.process_file, self.args.file)
+                profile.dump_stats(self.args.cprofile)
+            else:
+                self.process_file(self.args.file)
+            self.report()
             sys.exit(0)
 
-        for file in self.get_next_file():
+        if not self.args.test:
+            self.setup_log_file()
+
+        if self.args.apply is not None:
+            moved = apply_plan(self.args.apply)
+            if self.args.dst is not None:
+                contents = self.get_contents()
+                for dst in moved:
+                    contents.add(dst)
+            return
+
+        if self.args.rescan_dst and self.args.dst is not None:
+            self.get_contents().scan()
+
+        if (self.args.incremental or self.args.resume) and not self.args.test \
+                and self.args.plan is None:
+            self.journal = Journal()
+            self.journal.start(self.args.src, self.args.incremental, self.args.resume,
+                               self.get_filter_key())
+
+        watcher = None
+        if self.args.watch:
+            from organize.watch import create_watcher
+
+            # Started before the first pass, so files arriving while it runs
+            # are not missed
+            watcher = create_watcher(self.args.src, self.args.polling)
+
+        try:
+            if self.args.jobs > 1:
+                self.run_parallel()
+            else:
+                self.run_sequential(self.get_next_file())
+
+            if self.journal is not None:
+                self.journal.finish()
+
+            self.actions.close()
+            self.report()
+        except:
+            if watcher is not None:
+                watcher.close()
+            raise
+
+        if watcher is not None:
+            from organize.watch import watch, DEFAULT_SETTLE_TIME
+
+            settle_time = self.args.settle_time
+            if settle_time is None:
+                settle_time = DEFAULT_SETTLE_TIME
+            logger.info("Watching %s for new files", self.args.src)
+            # Files may be added to or removed from the destination between
+            # batches, its folders are listed again for every batch
+            self.run_sequential(watch(watcher, self.filter, settle_time,
+                                      self.actions.namespace.reset))
+
+    def report(self):
+        if not stats.enabled:
+            return
+        print(stats.report())
+        if self.args.profile_json is not None:
+            stats.write(self.args.profile_json)
+
+    def run_sequential(self, files):
+        for file in files:
+            failed = True
+            try:
+                failed = self.process_file(file) is None
+            except FileProcessException:
+                logger.error('Skipping %s' % file)
+            except:
+                logger.error("Unhandled exception while processing file %s" % file)
+                raise
+            self.file_done(file, failed)
+
+    def run_parallel(self):
+        # All destination decisions are made here, in a single process,
+        # so workers never race for the same target name
+        for info, target, error, worker_stats in self.get_targets():
+            file = info.filename
+            info.loader = self
+            if worker_stats is not None:
+                stats.merge(worker_stats)
+            failed = True
             try:
-                self.process_file(file)
+                if error is not None:
+                    raise FileProcessException(error)
+                if info.has_md5():
+                    self.index.store_md5(file, info.md5, info.stat)
+                if target is not None:
+                    self.place_file(info, target)
+                    failed = False
             except FileProcessException:
                 logger.error('Skipping %s' % file)
             except:
                 logger.error("Unhandled exception while processing file %s" % file)
                 raise
+            self.file_done(file, failed)
+
+_worker = None
+
+def init_worker(args):
+    global _worker
+    _worker = App(args)
+    stats.enabled = args.profile or args.profile_json is not None
+
+def process_worker(filename):
+    # Extracts metadata of a file in a worker process. If the target already
+    # exists, md5 of the file is calculated too, move_file() will need it.
+    info = FileInfo(filename, _worker)
+    try:
+        target = _worker.get_target(info)
+    except FileProcessException as e:
+        return info, None, str(e), take_stats()
+
+    if target is not None and not _worker.args.test and os.path.exists(target):
+        # Computed now and sent along with the rest of info
+        info.md5
+
+    return info, target, None, take_stats()
+
+def take_stats():
+    return stats.take() if stats.enabled else None
 
 if __name__ == '__main__':
     app = App()
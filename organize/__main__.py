@@ -0,0 +1,5 @@
+import sys
+
+from organize.cli import main
+
+sys.exit(main())
@@ -0,0 +1,106 @@
+# Rule based classification
+#
+# Some images are not photos and shouldn't be sorted by date: screenshots,
+# square pictures from messengers, PNG exports. Classification rules send
+# them to their own folders instead. Rules are checked in order, the first
+# matching one wins, and they only use metadata FileInfo reads anyway (the
+# image header and EXIF), so classification costs no extra reads.
+#
+# A rule is a dictionary of conditions and an action:
+#
+#   "size": [[w, h], ...]   displayed size of the image is one of these
+#   "square": true/false    width equals height
+#   "format": ["png", ...]  image format detected by Pillow
+#   "exif": true/false      the file has EXIF
+#   "dst": "path"           destination folder, relative to --dst unless
+#                           absolute, "~" is expanded
+#   "rename": "md5"         names the file by its md5, keeps the name if omitted
+
+import os
+import json
+import logging
+
+logger = logging.getLogger("organize")
+
+SCREENSHOTS = ((533, 800), (540, 800), (640, 960), (640, 1136), (720, 1280))
+
+# Rules of the former remsq.py script
+DEFAULT_RULES = [
+    {'name': 'square', 'square': True, 'dst': '~/Pictures/archive/square', 'rename': 'md5'},
+    {'name': 'screenshots', 'size': SCREENSHOTS, 'dst': '~/Pictures/archive/screenshots'},
+    {'name': 'png', 'format': ['png'], 'dst': '~/Pictures/archive/png', 'rename': 'md5'},
+]
+
+CONDITIONS = ('size', 'square', 'format', 'exif')
+
+def check_rule(rule):
+    if 'dst' not in rule:
+        raise ValueError('Classification rule without "dst": %s' % rule)
+    if not any(key in rule for key in CONDITIONS):
+        raise ValueError('Classification rule without conditions: %s' % rule)
+    if rule.get('rename', 'md5') != 'md5':
+        raise ValueError('Unknown "rename" value: %s' % rule['rename'])
+
+def load_rules(filename):
+    # Reads rules from a JSON file like
+    # {"rules": [{"name": "png", "format": ["png"], "dst": "png", "rename": "md5"}]}
+    with open(filename, 'rt') as f:
+        config = json.load(f)
+    rules = config.get('rules', [])
+    for rule in rules:
+        check_rule(rule)
+    return rules
+
+class Classifier():
+
+    def __init__(self, rules, root):
+        # root is the folder relative destinations are in
+        self.rules = []
+        for rule in rules:
+            rule = dict(rule)
+            rule['dst'] = os.path.join(root, os.path.expanduser(rule['dst']))
+            if 'size' in rule:
+                rule['size'] = set(tuple(size) for size in rule['size'])
+            if 'format' in rule:
+                rule['format'] = set(f.lower() for f in rule['format'])
+            self.rules.append(rule)
+
+    def get_suffixes(self):
+        # Returns file name suffixes of formats the rules look for
+        return tuple(sorted(set(f for rule in self.rules for f in rule.get('format', ()))))
+
+    def matches(self, rule, info):
+        # Cheap conditions first, the image header is read only if needed
+        if 'exif' in rule and (info.exif not in (None, {})) != rule['exif']:
+            return False
+        if 'format' in rule and info.format not in rule['format']:
+            return False
+        if 'square' in rule and (info.size[0] == info.size[1]) != rule['square']:
+            return False
+        if 'size' in rule and info.size not in rule['size']:
+            return False
+        return True
+
+    def classify(self, info):
+        # Returns target filename for FileInfo info if a rule matches it,
+        # None otherwise
+        for rule in self.rules:
+            try:
+                if not self.matches(rule, info):
+                    continue
+            except (OSError, SyntaxError, ValueError):
+                # Not an image Pillow can read
+                continue
+
+            logger.info("%s matches rule %s", info.filename, rule.get('name', rule['dst']))
+            if rule.get('rename') == 'md5':
+                name = '%s.%s' % (info.md5, info.filename.split('.')[-1])
+            else:
+                name = os.path.basename(info.filename)
+            return os.path.join(rule['dst'], name)
+
+        return None
+
+def get_classifier(rules_filename, root):
+    rules = DEFAULT_RULES if rules_filename is None else load_rules(rules_filename)
+    return Classifier(rules, root)
@@ -0,0 +1,62 @@
+# Shared command line entry point
+#
+#   python -m organize <command> [arguments]
+#
+# runs one of the tools (organize.py, hash.py, remdup.py, shards.py) with
+# the given arguments. Only the chosen tool is loaded, and tools import
+# heavy modules (Pillow, NumPy, multiprocessing) only when they are used,
+# which matters when they are started for every uploaded file.
+
+import os
+import sys
+import runpy
+import logging
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'organize': 'Sorts images into folders by date',
+    'hash': 'Prints md5 and perceptual hashes of files',
+    'remdup': 'Removes duplicates',
+    'shards': 'Finds duplicates over several storage nodes',
+}
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def setup_logging(stream=sys.stdout, log_file=None):
+    # log_file is created when the first message is logged
+    logging.basicConfig(format=LOG_FORMAT, level=logging.INFO, stream=stream)
+    if log_file is not None:
+        handler = logging.FileHandler(log_file, delay=True)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logging.getLogger("organize").addHandler(handler)
+
+def load_script(name):
+    # Tools are scripts next to the package, organize.py clashes with the
+    # package name, so they are loaded by path
+    spec = importlib.util.spec_from_file_location('%s_script' % name,
+                                                  os.path.join(ROOT, '%s.py' % name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def usage():
+    lines = ['Usage: python -m organize <command> [arguments]', '', 'Commands:']
+    lines.extend('  %-10s %s' % item for item in COMMANDS.items())
+    return '\n'.join(lines)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        return 2
+
+    # The tool runs as __main__, the way it does when started directly, so
+    # worker processes find their functions
+    script = os.path.join(ROOT, '%s.py' % argv[0])
+    sys.argv = [script] + argv[1:]
+    runpy.run_path(script, run_name='__main__')
+    return 0
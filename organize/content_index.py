@@ -0,0 +1,202 @@
+# Content index of the destination
+#
+# Keeps size, partial hash and md5 of every file placed in a destination
+# folder, so an incoming file is checked against the whole destination
+# before it's moved, not only against the file under its target name.
+# Files are looked up by size first, which is a single indexed query; the
+# partial hash and md5 of indexed files are computed only when a file of
+# the same size arrives, and remembered. A destination is scanned once,
+# when it's used for the first time, after that the index is updated as
+# files are moved in and removed. Files a plan moves into the destination
+# are kept in memory only, until the plan is applied.
+
+import os
+import sqlite3
+import logging
+
+from organize.pcp_hash import get_partial_hash, get_pcp_hash_dir
+from organize.stats import stats
+from organize.walker import walk
+
+logger = logging.getLogger("organize")
+
+# Number of writes after which pending changes are committed
+COMMIT_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS contents (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    partial TEXT,
+    md5 TEXT
+);
+CREATE INDEX IF NOT EXISTS contents_size ON contents (size, path);
+"""
+
+def get_content_index_filename():
+    return os.path.join(get_pcp_hash_dir(), 'contents.sqlite')
+
+class ContentIndex():
+
+    def __init__(self, root, get_file_hash, suffixes=None, filename=None):
+        # get_file_hash(filename, stat) returns md5 of a file, suffixes
+        # limit files indexed by the initial scan
+        if filename is None:
+            filename = get_content_index_filename()
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.root = os.path.abspath(root)
+        self.get_file_hash = get_file_hash
+        self.suffixes = suffixes
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.writes = 0
+        # size -> {planned path: [source file, md5 or None]}
+        self.planned = {}
+        # planned path -> size
+        self.planned_sizes = {}
+
+        row = self.conn.execute('SELECT path FROM roots WHERE path = ?', (self.root,)).fetchone()
+        if row is None:
+            self.scan()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+        self.writes = 0
+
+    def written(self, count=1):
+        self.writes += count
+        if self.writes >= COMMIT_INTERVAL:
+            self.commit()
+
+    def scan(self):
+        # Indexes files of the destination which are not indexed yet. Only
+        # sizes are recorded, hashes are computed on demand.
+        logger.info("Indexing contents of %s", self.root)
+        rows = []
+        with stats.stage('content_scan'):
+            for entry in walk(self.root, self.suffixes):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                rows.append((entry.path, st.st_size, st.st_mtime_ns))
+            self.conn.executemany('INSERT OR IGNORE INTO contents (path, size, mtime_ns) '
+                                  'VALUES (?, ?, ?)', rows)
+            self.conn.execute('INSERT OR IGNORE INTO roots (path) VALUES (?)', (self.root,))
+        self.commit()
+        logger.info("%d files found in %s", len(rows), self.root)
+
+    def add(self, path, md5=None):
+        # Records a file placed in the destination
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self.conn.execute('INSERT OR REPLACE INTO contents (path, size, mtime_ns, partial, md5) '
+                          'VALUES (?, ?, ?, NULL, ?)', (path, st.st_size, st.st_mtime_ns, md5))
+        self.written()
+
+    def discard(self, path):
+        self.conn.execute('DELETE FROM contents WHERE path = ?', (os.path.abspath(path),))
+        self.written()
+
+    def add_planned(self, path, src, size, md5=None):
+        # Records a file a plan moves from src to path, it's not there yet
+        path = os.path.abspath(path)
+        self.discard_planned(path)
+        self.planned.setdefault(size, {})[path] = [os.path.abspath(src), md5]
+        self.planned_sizes[path] = size
+
+    def discard_planned(self, path):
+        path = os.path.abspath(path)
+        size = self.planned_sizes.pop(path, None)
+        if size is not None:
+            del self.planned[size][path]
+
+    def find_planned(self, info, size):
+        # Returns planned path of a file with the same contents as info
+        src = os.path.abspath(info.filename)
+        for path, entry in self.planned.get(size, {}).items():
+            if entry[0] == src:
+                continue
+            if entry[1] is None:
+                try:
+                    entry[1] = self.get_file_hash(entry[0], None)
+                except OSError:
+                    continue
+            if entry[1] == info.md5:
+                return path
+        return None
+
+    def get_candidates(self, size):
+        # Returns rows of indexed files under the root with the given size
+        return self.conn.execute('SELECT path, mtime_ns, partial, md5 FROM contents '
+                                 'WHERE size = ? AND path > ? AND path < ?',
+                                 (size, self.root + os.sep,
+                                  self.root + chr(ord(os.sep) + 1))).fetchall()
+
+    def find_duplicate(self, info):
+        # Returns path of an indexed file with the same contents as the
+        # file described by FileInfo info, None if there is no such file
+        size = info.file_size
+        if self.planned.get(size):
+            path = self.find_planned(info, size)
+            if path is not None:
+                stats.count('content_index_hit')
+                return path
+
+        candidates = self.get_candidates(size)
+        if not candidates:
+            stats.count('content_index_miss')
+            return None
+
+        partial = None
+        src = os.path.abspath(info.filename)
+        for path, mtime_ns, dst_partial, dst_md5 in candidates:
+            if path == src:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or st.st_size != size or st.st_mtime_ns != mtime_ns:
+                # The file was changed or removed behind our back
+                self.discard(path)
+                if st is None:
+                    continue
+                self.add(path)
+                dst_partial = dst_md5 = None
+                if st.st_size != size:
+                    continue
+
+            if partial is None:
+                partial = get_partial_hash(info.filename, size)
+            if dst_partial is None:
+                dst_partial = get_partial_hash(path, size)
+                self.conn.execute('UPDATE contents SET partial = ? WHERE path = ?',
+                                  (dst_partial, path))
+                self.written()
+            if partial != dst_partial:
+                continue
+
+            if dst_md5 is None:
+                dst_md5 = self.get_file_hash(path, st)
+                self.conn.execute('UPDATE contents SET md5 = ? WHERE path = ?', (dst_md5, path))
+                self.written()
+            if info.md5 == dst_md5:
+                stats.count('content_index_hit')
+                return path
+
+        stats.count('content_index_miss')
+        return None
@@ -0,0 +1,95 @@
+# Date and time detection from file and folder names
+#
+# All rules are compiled into a single regular expression. Every rule is
+# prefixed with a lazy "match anything" and the alternation is anchored at
+# the beginning, so the regex engine tries rules in order exactly like
+# calling re.search() with each of them in turn would, but in a single call.
+
+import re
+import json
+
+# Format meaning the date is a number of milliseconds since Unix epoch
+EPOCH_MS = 'epoch_ms'
+
+# (pattern, format) in order of priority, the date is captured by the group
+# named "date"
+FILENAME_RULES = [
+    # Unix epoch
+    (r'^(?P<date>1(?:4|5)\d{11})\.(?:jpg|jpeg|mp4)$', EPOCH_MS),
+    # IMG_20160407_193522_HDR_1460046931206.jpg
+    (r'IMG_(?P<date>\d{8}_\d{6}).(?:jpg|jpeg)', '%Y%m%d_%H%M%S'),
+    (r'(?P<date>\d{8}_\d{6}).(?:jpg|jpeg)', '%Y%m%d_%H%M%S'),
+    (r'(?P<date>\d{8}_\d{6})_HDR.(?:jpg|jpeg)', '%Y%m%d_%H%M%S'),
+    (r'IMG_(?P<date>\d{8}_\d{6})_HDR_\d{13}.jpg', '%Y%m%d_%H%M%S'),
+    (r'PANO_(?P<date>\d{8}_\d{6}).(?:jpg|jpeg)', '%Y%m%d_%H%M%S'),
+    (r'(?:VID|video)_(?P<date>\d{8}_\d{6}).mp4', '%Y%m%d_%H%M%S'),
+    (r'(?P<date>\d{8}_\d{6}).(mp4)', '%Y%m%d_%H%M%S'),
+    (r'(?P<date>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}).jpg', '%Y-%m-%d_%H-%M-%S'),
+    (r'IMG\-(?P<date>\d{8})-WA\d{4}.(?:jpg|jpeg)', '%Y%m%d'),
+    (r'IMG_(?P<date>\d{8}_\d{6})_(.*)?\d{13}.jpg', '%Y%m%d_%H%M%S'),
+    (r'IMG_(?P<date>\d{8}_\d{6})_HHT.jpg', '%Y%m%d_%H%M%S'),
+]
+
+FOLDER_RULES = [
+    (r'(?P<date>\d{4}-\d{2}-\d{2})', '%Y-%m-%d'),
+    (r'(?P<date>\d{2}-\d{2}-\d{4})', '%d-%m-%Y'),
+    (r'(?P<date>\d{2}\.\d{2}\.\d{2})', '%d.%m.%y'),
+]
+
+def check_rule(pattern):
+    if 'date' not in re.compile(pattern).groupindex:
+        raise ValueError('Pattern %s has no group named "date"' % pattern)
+
+def compile_rules(rules):
+    # Named groups of rule i get suffix _i to keep them unique
+    alternatives = []
+    for i, (pattern, format_) in enumerate(rules):
+        check_rule(pattern)
+        pattern = re.sub(r'\(\?P([<=])(\w+)', r'(?P\1\2_%d' % i, pattern)
+        alternatives.append('(?P<rule_%d>[\\s\\S]*?%s)' % (i, pattern))
+    return re.compile('^(?:%s)' % '|'.join(alternatives))
+
+class DateMatcher():
+
+    def __init__(self, filename_rules=FILENAME_RULES, folder_rules=FOLDER_RULES):
+        self.filename_rules = list(filename_rules)
+        self.folder_rules = list(folder_rules)
+        self.filename_regex = compile_rules(self.filename_rules)
+        self.folder_regex = compile_rules(self.folder_rules)
+
+    def search(self, regex, rules, name):
+        m = regex.match(name)
+        if m is None:
+            return None
+        # The rule's group is the outermost one, so it's closed last
+        i = int(m.lastgroup[len('rule_'):])
+        return m.group('date_%d' % i), rules[i][1]
+
+    def match(self, basename):
+        # Returns (date string, format) of the first matching rule or None
+        return self.search(self.filename_regex, self.filename_rules, basename)
+
+    def match_folder(self, name):
+        return self.search(self.folder_regex, self.folder_rules, name)
+
+def load_rules(filename):
+    # Reads additional rules from a JSON file like
+    # {"filename": [{"pattern": "DSC_(?P<date>\\d{8})", "format": "%Y%m%d"}],
+    #  "folder": [...]}
+    with open(filename, 'rt') as f:
+        config = json.load(f)
+    result = []
+    for key in ('filename', 'folder'):
+        rules = []
+        for rule in config.get(key, []):
+            check_rule(rule['pattern'])
+            rules.append((rule['pattern'], rule['format']))
+        result.append(rules)
+    return result
+
+def get_matcher(rules_filename=None):
+    # Rules from the file are tried after the built-in ones
+    if rules_filename is None:
+        return DateMatcher()
+    filename_rules, folder_rules = load_rules(rules_filename)
+    return DateMatcher(FILENAME_RULES + filename_rules, FOLDER_RULES + folder_rules)
@@ -0,0 +1,146 @@
+# Staged duplicate detection
+#
+# Files from the source and the destination are compared by cheap keys
+# first, and only the ones that still collide go to the next, more
+# expensive stage: size -> first and last 64 KiB -> md5. Perceptual hashes
+# are only calculated when near duplicates are requested, images whose
+# hashes differ in at most max_distance bits are considered duplicates.
+# Closeness is not transitive, so a source image is only a near duplicate
+# of the destination images close to it, never of ones reached through
+# other images.
+
+import os
+import logging
+
+from organize.pcp_hash import get_partial_hash
+from organize.hamming import HammingIndex
+
+logger = logging.getLogger("organize")
+
+SRC = 0
+DST = 1
+
+def report_stage(name, before, after):
+    logger.info("Stage %s: %d candidates, %d eliminated", name, after, before - after)
+
+def count_files(groups):
+    return sum(len(group) for group in groups)
+
+def is_shared(group):
+    # Only groups with files on both sides contain duplicates
+    return len(set(side for side, filename in group)) > 1
+
+def refine(groups, key_func):
+    # Splits each group by key_func(filename), dropping files whose key
+    # is None and groups which no longer have files on both sides
+    result = []
+    for group in groups:
+        subgroups = {}
+        for side, filename in group:
+            key = key_func(filename)
+            if key is not None:
+                subgroups.setdefault(key, []).append((side, filename))
+        result.extend(g for g in subgroups.values() if is_shared(g))
+    return result
+
+def stat_files(src_files, dst_files):
+    # Returns (src files, dst files, {filename: size}) of files which can be
+    # read. A source file which is a destination file itself, under the same
+    # path or as another hard link, is never a duplicate of it and is dropped.
+    sizes = {}
+    dst_ids = set()
+    dst_result = []
+    for filename in dst_files:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        dst_ids.add((st.st_dev, st.st_ino))
+        sizes[filename] = st.st_size
+        dst_result.append(filename)
+
+    src_result = []
+    for filename in src_files:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            continue
+        if (st.st_dev, st.st_ino) in dst_ids:
+            logger.warning("%s is also in the destination, skipping it", filename)
+            continue
+        sizes[filename] = st.st_size
+        src_result.append(filename)
+
+    return src_result, dst_result, sizes
+
+def group_by_size(src_files, dst_files, sizes):
+    groups = {}
+    for side, files in ((SRC, src_files), (DST, dst_files)):
+        for filename in files:
+            groups.setdefault(sizes[filename], []).append((side, filename))
+    return [g for g in groups.values() if is_shared(g)]
+
+def split_sides(group):
+    return ([filename for side, filename in group if side == SRC],
+            [filename for side, filename in group if side == DST])
+
+def get_pcp_key(index, filename):
+    pcp = index.get_pcp_hash(filename)
+    # A hash without bits set belongs to a uniform image, it matches
+    # images which have nothing in common
+    if pcp is None or int(pcp, 16) == 0:
+        return None
+    return pcp
+
+def match_near(src_files, dst_files, key_func, max_distance):
+    # Returns ([src file], dst files) groups of each source file whose key
+    # is within max_distance from keys of destination files. Only
+    # destination keys are indexed, so source files are never matched with
+    # each other.
+    index = HammingIndex(max_distance)
+    for filename in dst_files:
+        key = key_func(filename)
+        if key is not None:
+            index.add(key, filename)
+    if not len(index):
+        return []
+
+    result = []
+    for filename in src_files:
+        key = key_func(filename)
+        if key is None:
+            continue
+        matches = index.query(key)
+        if matches:
+            result.append(([filename], [dst for dst, distance in matches]))
+    return result
+
+def find_duplicates(src_files, dst_files, index, near=False, max_distance=0):
+    # Returns list of (src files, dst files) groups of duplicates
+    src_files, dst_files, sizes = stat_files(src_files, dst_files)
+    total = len(src_files) + len(dst_files)
+
+    groups = group_by_size(src_files, dst_files, sizes)
+    report_stage('size', total, count_files(groups))
+
+    before = count_files(groups)
+    groups = refine(groups, lambda filename: get_partial_hash(filename, sizes[filename]))
+    report_stage('partial hash', before, count_files(groups))
+
+    before = count_files(groups)
+    groups = refine(groups, index.get_file_hash)
+    report_stage('md5', before, count_files(groups))
+
+    result = [split_sides(group) for group in groups]
+
+    if near:
+        found = set(filename for group in groups for side, filename in group if side == SRC)
+        src_left = [filename for filename in src_files if filename not in found]
+        before = len(src_left) + len(dst_files)
+        near_groups = match_near(src_left, dst_files, lambda filename: get_pcp_key(index, filename),
+                                 max_distance)
+        report_stage('perceptual hash', before,
+                     len(set(f for src, dst in near_groups for f in src + dst)))
+        result.extend(near_groups)
+
+    return result
@@ -0,0 +1,153 @@
+# Header-only EXIF reader
+#
+# Reads a bounded prefix of a JPEG file and parses only the TIFF structure
+# of its APP1 segment, extracting the few tags organize.py needs. Values are
+# converted the same way App.exif2text converts Pillow's ones. Dimensions of
+# the image are taken from its SOF segment in the same prefix, so JPEGs
+# don't need to be opened by Pillow to get them.
+
+import struct
+
+from organize.stats import stats
+
+# Maximum number of bytes read from a file
+EXIF_READ_LIMIT = 128 * 1024
+
+EXIF_IFD_POINTER = 0x8769
+ORIENTATION = 0x0112
+
+TAGS = {0x010f: 'Make',
+        0x0110: 'Model',
+        ORIENTATION: 'Orientation',
+        0x0132: 'DateTime',
+        EXIF_IFD_POINTER: 'ExifOffset',
+        0x9003: 'DateTimeOriginal'}
+
+# TIFF field types we are able to decode: type -> (struct format, size)
+FIELD_TYPES = {2: ('s', 1),   # ASCII
+               3: ('H', 2),   # SHORT
+               4: ('L', 4)}   # LONG
+
+MARKER_SOI = b'\xff\xd8'
+MARKER_APP1 = 0xe1
+# Start of frame markers, C4, C8 and CC in this range are other segments
+MARKERS_SOF = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+MARKER_SOS = 0xda
+MARKER_EOI = 0xd9
+
+class ExifError(Exception):
+    pass
+
+def find_segments(data):
+    # Returns TIFF block of the Exif APP1 segment, None if the image has no
+    # EXIF, and (width, height) from the SOF segment, None if it's not found
+    # within data
+    if not data.startswith(MARKER_SOI):
+        raise ExifError('Not a JPEG file')
+
+    tiff = None
+    found_app1 = False
+    size = None
+    pos = 2
+    while not (found_app1 and size is not None):
+        if pos + 4 > len(data):
+            if not found_app1:
+                raise ExifError('EXIF segment is beyond the read limit')
+            break
+        if data[pos] != 0xff:
+            if not found_app1:
+                raise ExifError('Invalid JPEG marker')
+            break
+        marker = data[pos + 1]
+        if marker == 0xff:
+            # Fill byte
+            pos += 1
+            continue
+        if marker in (MARKER_SOS, MARKER_EOI):
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker == MARKER_APP1 and not found_app1 and \
+                data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            end = pos + 2 + length
+            if end > len(data):
+                raise ExifError('EXIF segment is beyond the read limit')
+            tiff = data[pos + 10:end]
+            found_app1 = True
+        elif marker in MARKERS_SOF and pos + 9 <= len(data):
+            # Precision, height, width
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            size = (width, height)
+        pos += 2 + length
+    return tiff, size
+
+def read_value(tiff, order, field_type, count, value_offset):
+    if field_type not in FIELD_TYPES:
+        return None
+    fmt, size = FIELD_TYPES[field_type]
+    if size * count <= 4:
+        start = value_offset
+    else:
+        start = struct.unpack(order + 'L', tiff[value_offset:value_offset + 4])[0]
+    if start + size * count > len(tiff):
+        raise ExifError('Value is out of bounds')
+
+    if field_type == 2:
+        return tiff[start:start + count].decode('latin-1').replace('\u0000', '')
+    return str(struct.unpack_from(order + fmt, tiff, start)[0])
+
+def read_ifd(tiff, order, offset, exif):
+    if offset + 2 > len(tiff):
+        raise ExifError('IFD is out of bounds')
+    count = struct.unpack_from(order + 'H', tiff, offset)[0]
+    if offset + 2 + count * 12 > len(tiff):
+        raise ExifError('IFD is out of bounds')
+
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, field_type, value_count = struct.unpack_from(order + 'HHL', tiff, entry)
+        if tag in TAGS:
+            value = read_value(tiff, order, field_type, value_count, entry + 8)
+            if value is not None:
+                exif[TAGS[tag]] = value
+
+def parse_tiff(tiff):
+    if tiff[:4] == b'II*\x00':
+        order = '<'
+    elif tiff[:4] == b'MM\x00*':
+        order = '>'
+    else:
+        raise ExifError('Invalid TIFF header')
+
+    exif = {}
+    read_ifd(tiff, order, struct.unpack_from(order + 'L', tiff, 4)[0], exif)
+    if 'ExifOffset' in exif:
+        read_ifd(tiff, order, int(exif['ExifOffset']), exif)
+    return exif
+
+def get_orientation(data):
+    # Returns value of the Orientation tag of EXIF data as Pillow keeps it in
+    # Image.info['exif'], 1 (normal) if it's missing or can't be parsed
+    if data.startswith(b'Exif\x00\x00'):
+        data = data[6:]
+    try:
+        return int(parse_tiff(data).get('Orientation', 1))
+    except (ExifError, struct.error, ValueError):
+        return 1
+
+def read_jpeg_header(filename, limit=EXIF_READ_LIMIT):
+    # Returns (EXIF, size) of a JPEG: dict of EXIF tags, {} if the image has
+    # no EXIF or None if the file could not be parsed within the limit, and
+    # (width, height) as stored, None if it's unknown
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read(limit)
+        stats.count('bytes_read', len(data))
+        tiff, size = find_segments(data)
+    except (OSError, ExifError, struct.error):
+        return None, None
+    if tiff is None:
+        return {}, size
+    try:
+        return parse_tiff(tiff), size
+    except (ExifError, struct.error):
+        return None, size
@@ -0,0 +1,122 @@
+# Lazily computed file metadata
+#
+# FileInfo computes every piece of metadata on first use and remembers it,
+# so a file is opened and read at most once no matter how many times its
+# EXIF, dimensions or hashes are needed. Loading is delegated to a loader
+# object (organize.App), which is not pickled: FileInfo objects filled in a
+# worker process are sent to the main one with everything computed so far.
+
+import os
+
+class Unknown():
+    # Marks values which are not computed yet
+    pass
+
+UNKNOWN = Unknown()
+
+# Orientations turning the image by 90 degrees
+TRANSPOSED_ORIENTATIONS = ('5', '6', '7', '8')
+
+class FileInfo():
+
+    __slots__ = ('filename', 'loader', '_stat', '_size', '_format', '_exif', '_md5', '_pcp_hash')
+
+    FIELDS = ('_stat', '_size', '_format', '_exif', '_md5', '_pcp_hash')
+
+    def __init__(self, filename, loader):
+        self.filename = filename
+        self.loader = loader
+        for name in self.FIELDS:
+            setattr(self, name, UNKNOWN)
+
+    def __getstate__(self):
+        state = {'filename': self.filename}
+        for name in self.FIELDS:
+            if getattr(self, name) is not UNKNOWN:
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        self.loader = None
+        for name in self.FIELDS:
+            setattr(self, name, UNKNOWN)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def has_md5(self):
+        return self._md5 is not UNKNOWN
+
+    @property
+    def stat(self):
+        if self._stat is UNKNOWN:
+            self._stat = os.stat(self.filename)
+        return self._stat
+
+    @property
+    def file_size(self):
+        return self.stat.st_size
+
+    @property
+    def exif(self):
+        if self._exif is UNKNOWN:
+            # Dimensions of a JPEG are read along with its EXIF
+            self._exif, size = self.loader.get_header(self.filename)
+            if size is not None and self._size is UNKNOWN:
+                self._format = 'jpeg'
+                self.set_size(size)
+        return self._exif
+
+    def set_size(self, size):
+        w, h = size
+        if self.exif.get('Orientation') in TRANSPOSED_ORIENTATIONS:
+            w, h = h, w
+        self._size = (w, h)
+
+    def read_header(self):
+        # Pillow reads only the header here, for images other than JPEGs.
+        # Errors are remembered, so a broken file is opened once.
+        self.exif
+        if self._size is not UNKNOWN:
+            return
+
+        from PIL import Image
+
+        try:
+            with Image.open(self.filename) as image:
+                size = image.size
+                self._format = (image.format or '').lower()
+        except (OSError, SyntaxError, ValueError) as e:
+            self._size = self._format = e
+            raise
+        self.set_size(size)
+
+    @property
+    def size(self):
+        # (width, height) of the image as it's displayed, taking EXIF
+        # orientation into account
+        if self._size is UNKNOWN:
+            self.read_header()
+        if isinstance(self._size, Exception):
+            raise self._size
+        return self._size
+
+    @property
+    def format(self):
+        # Image format detected by Pillow, lowercase: 'jpeg', 'png', ...
+        if self._format is UNKNOWN:
+            self.read_header()
+        if isinstance(self._format, Exception):
+            raise self._format
+        return self._format
+
+    @property
+    def md5(self):
+        if self._md5 is UNKNOWN:
+            self._md5 = self.loader.get_file_hash(self.filename, self.stat)
+        return self._md5
+
+    @property
+    def pcp_hash(self):
+        if self._pcp_hash is UNKNOWN:
+            self._pcp_hash = self.loader.get_pcp_hash(self.filename, self.md5)
+        return self._pcp_hash
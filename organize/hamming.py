@@ -0,0 +1,69 @@
+# Near duplicate search over perceptual hashes
+#
+# HammingIndex implements multi-index hashing: hashes are split into
+# max_distance + 1 chunks, and two hashes differing in at most max_distance
+# bits must have at least one equal chunk (pigeonhole principle). Each chunk
+# has its own table, so a query only compares hashes sharing a chunk
+# instead of the whole set. With large max_distance chunks get too narrow
+# to filter anything out, so if NumPy is installed every query scans the
+# whole HashArray in bulk instead.
+
+from organize.pcp_hash import PCP_HASH_SIZE
+from organize.hasharray import HashArray, VECTORIZED, popcount, to_int
+
+# Chunks narrower than this match too many hashes to be worth indexing
+MIN_CHUNK_BITS = 8
+
+def hamming_distance(hash1, hash2):
+    # Returns number of different bits of two hex hashes
+    return popcount(int(hash1, 16) ^ int(hash2, 16))
+
+def get_chunks(max_distance, bits=PCP_HASH_SIZE):
+    # Returns (shift, mask) of every chunk, chunks differ in width by one bit at most
+    if not 0 <= max_distance < bits:
+        raise ValueError('max_distance should be from 0 to %d' % (bits - 1))
+    chunks = max_distance + 1
+    bounds = [bits * i // chunks for i in range(chunks + 1)]
+    return [(bounds[i], (1 << (bounds[i + 1] - bounds[i])) - 1) for i in range(chunks)]
+
+class HammingIndex():
+
+    def __init__(self, max_distance, bits=PCP_HASH_SIZE):
+        if max_distance >= bits:
+            raise ValueError('max_distance should be less than %d' % bits)
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        self.chunks = get_chunks(max_distance, bits)
+        self.scan = VECTORIZED and bits // chunks < MIN_CHUNK_BITS
+        self.tables = [] if self.scan else [{} for i in range(chunks)]
+        self.hashes = HashArray(bits)
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, value, item):
+        # value is a hash as an integer, hex string or bytes
+        value = to_int(value)
+        id_ = len(self.items)
+        self.hashes.append(value)
+        self.items.append(item)
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            table.setdefault((value >> shift) & mask, []).append(id_)
+        return id_
+
+    def query_ids(self, value):
+        # Returns {id: distance} of hashes within max_distance from value
+        value = to_int(value)
+        if self.scan:
+            return self.hashes.within(value, self.max_distance)
+        ids = set()
+        for (shift, mask), table in zip(self.chunks, self.tables):
+            ids.update(table.get((value >> shift) & mask, ()))
+        ids = sorted(ids)
+        return {id_: d for id_, d in zip(ids, self.hashes.distances(value, ids))
+                if d <= self.max_distance}
+
+    def query(self, value):
+        # Returns list of (item, distance) within max_distance from value
+        return [(self.items[id_], d) for id_, d in sorted(self.query_ids(value).items())]
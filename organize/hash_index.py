@@ -0,0 +1,223 @@
+# Persistent index of file hashes
+#
+# Files are identified by (device, inode) and considered unchanged while
+# their size and mtime_ns stay the same, so a warm lookup costs one stat()
+# instead of reading the whole file. Perceptual hashes are stored per md5,
+# so copies of the same file share them, as 32 byte blobs, along with the
+# version of the algorithm computing them. Hashes of other versions are
+# ignored and computed again, so hashes compared with each other are always
+# comparable. Hashes cached as <md5>.hash files by the ImageMagick based
+# versions are imported once, as version 0, so they are recomputed on use
+# too.
+
+import os
+import glob
+import atexit
+import sqlite3
+import logging
+
+from organize.pcp_hash import get_file_hash, get_pcp_hash_dir, calculate_pcp_hash, \
+    PCP_HASH_VERSION
+from organize.stats import stats
+from organize.hasharray import pack_hash, unpack_hash
+
+logger = logging.getLogger("organize")
+
+# Number of writes after which pending changes are committed
+COMMIT_INTERVAL = 1000
+
+# SQLite limits the number of host parameters in one statement
+LOOKUP_CHUNK_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    md5 TEXT NOT NULL,
+    PRIMARY KEY (dev, ino)
+);
+CREATE TABLE IF NOT EXISTS pcp_hashes (
+    md5 TEXT PRIMARY KEY,
+    pcp BLOB NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+def get_index_filename():
+    return os.path.join(get_pcp_hash_dir(), 'index.sqlite')
+
+class HashIndex():
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = get_index_filename()
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        is_new = not os.path.exists(filename)
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.writes = 0
+
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(pcp_hashes)')]
+        if 'version' not in columns:
+            # Hashes stored before versions were recorded may be ImageMagick ones
+            self.conn.execute('ALTER TABLE pcp_hashes ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+            self.commit()
+
+        if is_new:
+            self.import_hash_files(os.path.dirname(os.path.abspath(filename)))
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+        self.writes = 0
+
+    def written(self, count=1):
+        self.writes += count
+        if self.writes >= COMMIT_INTERVAL:
+            self.commit()
+
+    def lookup_md5(self, filename, st=None):
+        # Returns md5 of a file if it is known and the file has not changed
+        if st is None:
+            st = os.stat(filename)
+        row = self.conn.execute('SELECT size, mtime_ns, md5 FROM files WHERE dev = ? AND ino = ?',
+                                (st.st_dev, st.st_ino)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        return None
+
+    def lookup_many(self, filenames):
+        # Returns {filename: md5} for all unchanged files known to the index
+        stats = {}
+        for filename in filenames:
+            try:
+                stats[filename] = os.stat(filename)
+            except OSError:
+                continue
+
+        by_key = {}
+        for filename, st in stats.items():
+            by_key.setdefault((st.st_dev, st.st_ino), []).append(filename)
+
+        # Files are looked up per device, so each inode is found by a search
+        # of the (dev, ino) primary key instead of a scan of the whole table
+        by_dev = {}
+        for dev, ino in by_key:
+            by_dev.setdefault(dev, []).append(ino)
+
+        result = {}
+        for dev, inodes in by_dev.items():
+            for i in range(0, len(inodes), LOOKUP_CHUNK_SIZE):
+                chunk = inodes[i:i + LOOKUP_CHUNK_SIZE]
+                query = 'SELECT ino, size, mtime_ns, md5 FROM files WHERE dev = ? AND ino IN (%s)' % \
+                        ','.join('?' * len(chunk))
+                for ino, size, mtime_ns, md5 in self.conn.execute(query, [dev] + chunk):
+                    for filename in by_key[(dev, ino)]:
+                        st = stats[filename]
+                        if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                            result[filename] = md5
+
+        return result
+
+    def lookup_pcp_many(self, md5_list):
+        # Returns {md5: pcp} for all known md5 hashes
+        md5_list = list(set(md5_list))
+        result = {}
+        for i in range(0, len(md5_list), LOOKUP_CHUNK_SIZE):
+            chunk = md5_list[i:i + LOOKUP_CHUNK_SIZE]
+            query = 'SELECT md5, pcp FROM pcp_hashes WHERE md5 IN (%s) AND version = ?' % \
+                    ','.join('?' * len(chunk))
+            result.update((md5, unpack_hash(pcp))
+                          for md5, pcp in self.conn.execute(query, chunk + [PCP_HASH_VERSION]))
+        return result
+
+    def store_md5(self, filename, md5, st=None):
+        self.store_md5_many([(filename, md5, st)])
+
+    def store_md5_many(self, records):
+        # records is a list of (filename, md5, stat or None)
+        rows = []
+        for filename, md5, st in records:
+            if st is None:
+                st = os.stat(filename)
+            rows.append((st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                         os.path.abspath(filename), md5))
+        self.conn.executemany('INSERT OR REPLACE INTO files (dev, ino, size, mtime_ns, path, md5) '
+                              'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.written(len(rows))
+
+    def store_pcp_many(self, records, version=PCP_HASH_VERSION):
+        # records is a list of (md5, pcp), version is the version of the
+        # algorithm which computed them
+        records = [(md5, pack_hash(pcp), version) for md5, pcp in records]
+        self.conn.executemany('INSERT OR REPLACE INTO pcp_hashes (md5, pcp, version) '
+                              'VALUES (?, ?, ?)', records)
+        self.written(len(records))
+
+    def get_file_hash(self, filename, st=None):
+        if st is None:
+            st = os.stat(filename)
+        md5 = self.lookup_md5(filename, st)
+        if md5 is not None:
+            stats.count('md5_cache_hit')
+        else:
+            stats.count('md5_cache_miss')
+            md5 = get_file_hash(filename)
+            self.store_md5(filename, md5, st)
+        return md5
+
+    def get_pcp_hash(self, filename, md5=None):
+        if md5 is None:
+            md5 = self.get_file_hash(filename)
+        row = self.conn.execute('SELECT pcp FROM pcp_hashes WHERE md5 = ? AND version = ?',
+                                (md5, PCP_HASH_VERSION)).fetchone()
+        if row is not None:
+            stats.count('pcp_cache_hit')
+            return unpack_hash(row[0])
+
+        stats.count('pcp_cache_miss')
+        pcp = calculate_pcp_hash(filename)
+        if pcp is not None:
+            self.store_pcp_many([(md5, pcp)])
+        return pcp
+
+    def import_hash_files(self, path):
+        # Imports perceptual hashes cached as <md5>.hash files by earlier
+        # versions in the folder of the index. They were computed by
+        # ImageMagick, so they are stored as version 0 and replaced by new
+        # hashes when they are used.
+        records = []
+        for filename in glob.glob(os.path.join(path, '*.hash')):
+            md5 = os.path.basename(filename)[:-len('.hash')]
+            try:
+                with open(filename, 'rt') as f:
+                    pcp = f.read().strip()
+                int(pcp, 16)
+            except (OSError, ValueError):
+                logger.warning("Could not import %s", filename)
+                continue
+            records.append((md5, pcp))
+        if records:
+            logger.info("Importing %d cached hashes from %s", len(records), path)
+            self.store_pcp_many(records, version=0)
+            self.commit()
+        return len(records)
+
+_index = None
+
+def get_index():
+    # Returns index shared by the whole process
+    global _index
+    if _index is None:
+        _index = HashIndex()
+        atexit.register(_index.close)
+    return _index
@@ -0,0 +1,145 @@
+# Compact storage of perceptual hashes
+#
+# HashArray keeps hashes as fixed width rows of 64-bit words in a single
+# array('Q') instead of a Python string or integer per hash, which takes
+# 32 bytes per 256-bit hash instead of over a hundred. With NumPy installed
+# the rows are viewed as a uint64 matrix and distances from one hash to all
+# of them are computed in bulk by XOR and popcount.
+
+import sys
+import importlib.util
+from array import array
+
+# Whether bulk comparisons are vectorized. NumPy takes longer to import
+# than the rest of the tools, so it's imported on first bulk comparison.
+VECTORIZED = importlib.util.find_spec('numpy') is not None
+numpy = None
+
+# Number of set bits of every byte value, NumPy array
+BYTE_BITS = None
+
+from organize.pcp_hash import PCP_HASH_SIZE
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+# Fewer hashes are compared one by one, NumPy call overhead is higher
+BULK_SIZE = 32
+
+if hasattr(int, 'bit_count'):
+    def popcount(value):
+        return value.bit_count()
+else:
+    def popcount(value):
+        return bin(value).count('1')
+
+def import_numpy():
+    global numpy, BYTE_BITS
+    if numpy is None:
+        import numpy
+
+        BYTE_BITS = numpy.array([popcount(i) for i in range(256)], dtype=numpy.uint8)
+
+def count_bits(words):
+    # Returns number of set bits in every row of a uint64 matrix
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(words).sum(axis=1, dtype=numpy.int64)
+    # Older NumPy: number of bits of every byte is looked up in a table
+    octets = words.view(numpy.uint8).reshape(len(words), -1)
+    return BYTE_BITS[octets].sum(axis=1, dtype=numpy.int64)
+
+def to_int(value):
+    # Accepts a hash as an integer, hex string or big endian bytes
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return int(value, 16)
+    return int.from_bytes(value, 'big')
+
+def pack_hash(value, bits=PCP_HASH_SIZE):
+    # Returns hash as big endian bytes, the way it's stored in the index
+    return to_int(value).to_bytes(bits // 8, 'big')
+
+def unpack_hash(value, bits=PCP_HASH_SIZE):
+    # Returns hash as a hex string, the way it's printed and compared
+    if isinstance(value, str):
+        return value
+    return '%0*x' % (bits // 4, to_int(value))
+
+class HashArray():
+
+    def __init__(self, bits=PCP_HASH_SIZE):
+        if bits % WORD_BITS != 0:
+            raise ValueError('bits should be a multiple of %d' % WORD_BITS)
+        self.bits = bits
+        self.width = bits // WORD_BITS
+        self.words = array('Q')
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.words) // self.width
+
+    def append(self, value):
+        value = to_int(value)
+        # The matrix holds a buffer of the array, which can't grow while it's exported
+        self._matrix = None
+        self.words.extend((value >> (WORD_BITS * i)) & WORD_MASK for i in range(self.width))
+        return len(self) - 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('hash index out of range')
+        return self.get(i)
+
+    def get(self, i):
+        # Returns hash i as an integer, i is not checked
+        start = i * self.width
+        if sys.byteorder == 'little':
+            return int.from_bytes(self.words[start:start + self.width], 'little')
+        value = 0
+        for j in range(self.width):
+            value |= self.words[start + j] << (WORD_BITS * j)
+        return value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def matrix(self):
+        # Returns hashes as an (n, width) uint64 NumPy matrix sharing memory
+        # with the array
+        if self._matrix is None:
+            self._matrix = numpy.frombuffer(self.words, dtype=numpy.uint64).reshape(-1, self.width)
+        return self._matrix
+
+    def query(self, value):
+        # Returns integer hash as a row of the matrix
+        return numpy.array([(value >> (WORD_BITS * j)) & WORD_MASK for j in range(self.width)],
+                           dtype=numpy.uint64)
+
+    def distances(self, value, ids=None):
+        # Returns Hamming distances from value to hashes ids, all by default
+        value = to_int(value)
+        if ids is None:
+            ids = range(len(self))
+        if VECTORIZED and len(ids) >= BULK_SIZE:
+            import_numpy()
+            rows = self.matrix()[numpy.asarray(ids, dtype=numpy.intp)]
+            return count_bits(rows ^ self.query(value)).tolist()
+        get = self.get
+        return [popcount(value ^ get(i)) for i in ids]
+
+    def within(self, value, max_distance):
+        # Returns {id: distance} of all hashes within max_distance from value
+        if VECTORIZED:
+            import_numpy()
+            distances = count_bits(self.matrix() ^ self.query(to_int(value)))
+            ids = numpy.nonzero(distances <= max_distance)[0]
+            return dict(zip(ids.tolist(), distances[ids].tolist()))
+        return {i: d for i, d in enumerate(self.distances(value)) if d <= max_distance}
@@ -0,0 +1,241 @@
+# Run journal
+#
+# Remembers directories which had nothing left to process and files which
+# could not be processed, so the next run neither lists nor opens them again
+# unless they change. A directory is considered unchanged while its mtime
+# is the same, which holds as long as no entries are added, removed or
+# renamed in it. Unchanged directories are not listed, but their
+# subdirectories are still checked, since changes deeper in the tree don't
+# update the mtime of parents. Files which failed in an unchanged directory
+# are checked one by one, since rewriting a file in place doesn't update
+# the mtime of its directory either. Entries are only valid for runs with
+# the same filter: a directory done while, say, videos were not organized
+# still has them to process once they are.
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime as dt
+
+from organize.pcp_hash import get_pcp_hash_dir
+
+logger = logging.getLogger("organize")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    src TEXT NOT NULL,
+    started TEXT NOT NULL,
+    finished TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    filter TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    filter TEXT NOT NULL DEFAULT ''
+);
+"""
+
+def get_journal_filename():
+    return os.path.join(get_pcp_hash_dir(), 'journal.sqlite')
+
+class Journal():
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = get_journal_filename()
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        # The walker may run in a different thread than the one processing
+        # files (multiprocessing.Pool feeds tasks from its own thread)
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        for table in ('dirs', 'files'):
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(%s)' % table)]
+            if 'filter' not in columns:
+                # Entries of earlier versions don't match any filter
+                self.conn.execute("ALTER TABLE %s ADD COLUMN filter TEXT NOT NULL DEFAULT ''" %
+                                  table)
+        self.conn.commit()
+        self.lock = threading.RLock()
+        self.run_id = None
+        self.incremental = False
+        self.filter = None
+        # Description of the files the filter accepts
+        self.filter_key = ''
+        # Directory -> files yielded from it and not yet processed
+        self.pending = {}
+
+    def start(self, src, incremental=False, resume=False, filter_key=''):
+        # With resume, continues the last unfinished run over src, skipping
+        # what it has done. With incremental, skips everything unchanged
+        # since any previous run. filter_key describes the files walk() is
+        # going to be given a filter for, what was done with another filter
+        # is done again.
+        src = os.path.abspath(src)
+        self.incremental = incremental
+        self.filter_key = filter_key
+        row = None
+        if resume:
+            row = self.conn.execute('SELECT id FROM runs WHERE src = ? AND finished IS NULL '
+                                    'ORDER BY id DESC LIMIT 1', (src,)).fetchone()
+        if row is not None:
+            self.run_id = row[0]
+            logger.info("Resuming run %d", self.run_id)
+        else:
+            cursor = self.conn.execute('INSERT INTO runs (src, started) VALUES (?, ?)',
+                                       (src, dt.now().isoformat()))
+            self.run_id = cursor.lastrowid
+        self.conn.commit()
+
+    def finish(self):
+        with self.lock:
+            self.conn.execute('UPDATE runs SET finished = ? WHERE id = ?',
+                              (dt.now().isoformat(), self.run_id))
+            self.conn.commit()
+
+    def get_run_condition(self):
+        if self.incremental:
+            return ' AND filter = ?', (self.filter_key,)
+        return ' AND run_id = ? AND filter = ?', (self.run_id, self.filter_key)
+
+    def get_dir(self, path, mtime_ns):
+        # Returns list of subdirectories if the directory is unchanged
+        condition, params = self.get_run_condition()
+        with self.lock:
+            row = self.conn.execute('SELECT mtime_ns, subdirs FROM dirs WHERE path = ?' + condition,
+                                    (path,) + params).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return json.loads(row[1])
+        return None
+
+    def is_file_known(self, path, st):
+        condition, params = self.get_run_condition()
+        with self.lock:
+            row = self.conn.execute('SELECT dev, ino, size, mtime_ns FROM files WHERE path = ?' +
+                                    condition, (path,) + params).fetchone()
+        return row == (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get_changed_failures(self, path):
+        # Returns names of files which failed in directory path and have
+        # changed since
+        condition, params = self.get_run_condition()
+        with self.lock:
+            rows = self.conn.execute('SELECT path, dev, ino, size, mtime_ns FROM files '
+                                     'WHERE path > ? AND path < ?' + condition,
+                                     (path + os.sep, path + chr(ord(os.sep) + 1)) +
+                                     params).fetchall()
+        names = []
+        for filename, dev, ino, size, mtime_ns in rows:
+            if os.path.dirname(filename) != path:
+                continue
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns) != (dev, ino, size, mtime_ns):
+                names.append(os.path.basename(filename))
+        return names
+
+    def list_dir(self, path):
+        # Returns names of subdirectories and [(filename, stat)] of files
+        subdirs = []
+        files = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file() and self.filter(entry.path):
+                        files.append((entry.path, entry.stat()))
+                except OSError:
+                    continue
+        return subdirs, files
+
+    def store_dir(self, path, mtime_ns, subdirs):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO dirs '
+                              '(path, mtime_ns, subdirs, run_id, filter) VALUES (?, ?, ?, ?, ?)',
+                              (path, mtime_ns, json.dumps(subdirs), self.run_id,
+                               self.filter_key))
+            self.conn.commit()
+
+    def complete_dir(self, path):
+        # Called when all files of a directory are processed. The directory
+        # is listed once again, so files added meanwhile are not lost.
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            subdirs, files = self.list_dir(path)
+        except OSError:
+            return
+        if all(self.is_file_known(filename, st) for filename, st in files):
+            self.store_dir(path, mtime_ns, subdirs)
+
+    def walk(self, top, filter_func):
+        # Yields files to process in the same order os.walk() does
+        self.filter = filter_func
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            key = os.path.abspath(path)
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                subdirs = self.get_dir(key, mtime_ns)
+                if subdirs is None:
+                    subdirs, files = self.list_dir(path)
+                else:
+                    files = None
+            except OSError:
+                continue
+
+            if files is None:
+                pending = [os.path.join(path, name) for name in self.get_changed_failures(key)]
+            else:
+                pending = [filename for filename, st in files
+                           if not self.is_file_known(os.path.abspath(filename), st)]
+            if pending:
+                with self.lock:
+                    self.pending[key] = set(os.path.abspath(f) for f in pending)
+                yield from pending
+            elif files is not None:
+                self.store_dir(key, mtime_ns, subdirs)
+
+            stack.extend(reversed([os.path.join(path, d) for d in subdirs]))
+
+    def done(self, filename, failed):
+        # Records that a file yielded by walk() has been processed
+        filename = os.path.abspath(filename)
+        path = os.path.dirname(filename)
+        with self.lock:
+            if failed:
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    st = None
+                if st is not None:
+                    self.conn.execute('INSERT OR REPLACE INTO files '
+                                      '(path, dev, ino, size, mtime_ns, run_id, filter) '
+                                      'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      (filename, st.st_dev, st.st_ino, st.st_size,
+                                       st.st_mtime_ns, self.run_id, self.filter_key))
+                    self.conn.commit()
+            pending = self.pending.get(path)
+            if pending is None:
+                return
+            pending.discard(filename)
+            if not pending:
+                del self.pending[path]
+                self.complete_dir(path)
@@ -0,0 +1,107 @@
+# Destination namespace index
+#
+# Every destination directory is listed once per run and its names are kept
+# in memory, so checking whether a name is taken or looking for a free
+# "__NNNN" suffix doesn't cost a stat() per candidate. The index is updated
+# as files are moved and removed. Paths outside of the root are checked on
+# disk as usual. Other processes may change the destination meanwhile, so
+# moves never replace a file the index missed, and listings are dropped
+# when they are found out of date.
+
+import os
+import re
+
+from organize.utils import add_index_to_filename
+
+INDEXED_FILENAME = re.compile(r'^(.*)__(\d{4})\.([^\.]+)$')
+
+class DestinationIndex():
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root) if root is not None else None
+        # directory -> set of names, None if the directory doesn't exist
+        self.dirs = {}
+        # filename -> first suffix index which may be free
+        self.free = {}
+
+    def reset(self):
+        # Forgets all listings, directories are listed again when used
+        self.dirs = {}
+        self.free = {}
+
+    def refresh(self, path):
+        # Forgets the listing of directory path
+        path = os.path.normpath(path)
+        self.dirs.pop(path, None)
+        prefix = path + os.sep
+        for filename in [f for f in self.free if f.startswith(prefix)]:
+            del self.free[filename]
+
+    def covers(self, path):
+        return self.root is not None and os.path.normpath(path).startswith(self.root + os.sep)
+
+    def get_names(self, path):
+        path = os.path.normpath(path)
+        if path not in self.dirs:
+            try:
+                self.dirs[path] = set(os.listdir(path))
+            except (FileNotFoundError, NotADirectoryError):
+                self.dirs[path] = None
+        return self.dirs[path]
+
+    def exists(self, path):
+        if not self.covers(path):
+            return os.path.exists(path)
+        directory, name = os.path.split(os.path.normpath(path))
+        names = self.get_names(directory)
+        return names is not None and name in names
+
+    def makedirs(self, path):
+        if not self.covers(path):
+            if not os.path.exists(path):
+                os.makedirs(path)
+            return
+        path = os.path.normpath(path)
+        if self.get_names(path) is not None:
+            return
+        os.makedirs(path, exist_ok=True)
+        self.dirs[path] = set()
+        # Parents known as missing exist now too
+        child = path
+        while self.covers(child):
+            parent, name = os.path.split(child)
+            if parent in self.dirs:
+                if self.dirs[parent] is None:
+                    self.dirs[parent] = set()
+                self.dirs[parent].add(name)
+            child = parent
+
+    def add(self, path):
+        if not self.covers(path):
+            return
+        directory, name = os.path.split(os.path.normpath(path))
+        names = self.dirs.get(directory)
+        if names is not None:
+            names.add(name)
+
+    def discard(self, path):
+        if not self.covers(path):
+            return
+        directory, name = os.path.split(os.path.normpath(path))
+        names = self.dirs.get(directory)
+        if names is not None:
+            names.discard(name)
+        m = INDEXED_FILENAME.match(path)
+        if m is not None:
+            # The suffix is free again
+            filename = '%s.%s' % (m.group(1), m.group(3))
+            self.free[filename] = min(self.free.get(filename, 2), int(m.group(2)))
+
+    def get_free_filename(self, dst):
+        # Returns dst with the first index not taken yet. Indexes below the
+        # remembered one are known to be taken, so each is checked once.
+        i = self.free.get(dst, 2)
+        while self.exists(add_index_to_filename(dst, i)):
+            i += 1
+        self.free[dst] = i
+        return add_index_to_filename(dst, i)
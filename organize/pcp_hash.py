@@ -1,11 +1,14 @@
 # Image perceptual hashing algorithm
+#
+# Pillow is imported by the functions needing it, so tools which only
+# hash file contents start without it.
 
 import os
 import math
 import hashlib
-import subprocess
 
-from PIL import Image
+from organize.stats import stats
+from organize.exif import get_orientation
 
 # Size of image perceptive hash, in bits, required to meet 2 conditions:
 # 1) Should be power of 2
@@ -13,75 +16,124 @@ from PIL import Image
 # Possible values are: 2, 4, 16, 64, 256, 1024, 4096, 16384, ...
 PCP_HASH_SIZE = 256
 
+# Version of the algorithm, stored with cached hashes. Hashes computed by
+# ImageMagick (version 0) and by Pillow (version 1) differ for the same
+# image, because the images are scaled differently, so cached hashes of
+# another version are computed again. Should be increased on any change
+# of get_thumbnail() or compute_pcp_hash() changing their output.
+PCP_HASH_VERSION = 1
+
 PCP_THUMB_SIZE = int(math.sqrt(PCP_HASH_SIZE))
 PCP_BITS_PER_ROW = PCP_THUMB_SIZE
 
+# Transpositions (names of PIL.Image constants) turning an image with the
+# given EXIF orientation upright
+ORIENTATION_TRANSPOSE = {2: 'FLIP_LEFT_RIGHT',
+                         3: 'ROTATE_180',
+                         4: 'FLIP_TOP_BOTTOM',
+                         5: 'TRANSPOSE',
+                         6: 'ROTATE_270',
+                         7: 'TRANSVERSE',
+                         8: 'ROTATE_90'}
+
+# Number of bytes read from each end of a file by get_partial_hash
+PARTIAL_HASH_SIZE = 64 * 1024
+
+# Files are hashed by chunks of this size, so memory use doesn't grow with
+# the file size
+HASH_CHUNK_SIZE = 1024 * 1024
+
 def get_file_size(filename):
     statinfo = os.stat(filename)
     return statinfo.st_size
 
 def get_file_hash(filename):
     # Returns file md5 hash
-    with open(filename, 'rb') as f:
-        md5 = hashlib.md5(f.read()).hexdigest()
-    return md5
-
-def get_hash_filename(md5_hash):
-    return os.path.join(get_pcp_hash_dir(), '%s.hash' % md5_hash)
+    md5 = hashlib.md5()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    total = 0
+    with stats.stage('md5'):
+        with open(filename, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                md5.update(view[:n])
+                total += n
+        stats.count('bytes_read', total)
+    return md5.hexdigest()
+
+def get_partial_hash(filename, size=None):
+    # Returns md5 of the first and the last PARTIAL_HASH_SIZE bytes of a file.
+    # Files of the same size with different partial hashes can't be equal.
+    if size is None:
+        size = get_file_size(filename)
+    md5 = hashlib.md5()
+    with stats.stage('partial_hash'), open(filename, 'rb') as f:
+        md5.update(f.read(PARTIAL_HASH_SIZE))
+        if size > PARTIAL_HASH_SIZE:
+            f.seek(max(PARTIAL_HASH_SIZE, size - PARTIAL_HASH_SIZE))
+            md5.update(f.read(PARTIAL_HASH_SIZE))
+        stats.count('bytes_read', min(size, 2 * PARTIAL_HASH_SIZE))
+    return md5.hexdigest()
 
 def get_pcp_hash_dir():
     return os.path.expanduser("~/.pcp_hash")
 
-def get_pcp_hash(filename):
-    # TODO
-    # Consider referring to this for more optimal algorithm
-    # http://www.ruanyifeng.com/blog/2011/07/imgHash.txt?spm=a2c65.11461447.0.0.1c8c3588zsrYlA&file=imgHash.txt
-    md5_hash = get_file_hash(filename)
-
-    if os.path.exists(get_hash_filename(md5_hash)):
-        return open(get_hash_filename(md5_hash), 'rt').read()
-
-    command = 'convert -depth 8 -strip -type Grayscale -geometry %sx%s! "%s" "%s/%s.png"' % \
-              (PCP_THUMB_SIZE, PCP_THUMB_SIZE, filename, get_pcp_hash_dir(), md5_hash)
-
-    try:
-        subprocess.run(command, shell=True, check=True)
-    except subprocess.CalledProcessError:
-        return None
-
-    im = Image.open('%s/%s.png' % (get_pcp_hash_dir(), md5_hash))
+def get_thumbnail(filename):
+    # Returns PCP_THUMB_SIZE x PCP_THUMB_SIZE grayscale thumbnail of the image.
+    # For JPEGs draft() makes the decoder scale the image down by up to 1/8
+    # while decoding DCT blocks, so we never build a full size bitmap.
+    from PIL import Image
+
+    im = Image.open(filename)
+    orientation = get_orientation(im.info.get('exif', b''))
+    im.draft('L', (PCP_THUMB_SIZE, PCP_THUMB_SIZE))
+    if im.mode != 'L':
+        im = im.convert('L')
+    # Aspect ratio is ignored on purpose, the same way "-geometry WxH!" does
+    thumbnail = im.resize((PCP_THUMB_SIZE, PCP_THUMB_SIZE), Image.LANCZOS, reducing_gap=2.0)
+    # Scaling each axis independently commutes with rotations and flips, so
+    # turning the thumbnail upright is the same as turning the whole image,
+    # and the file itself is never changed
+    if orientation in ORIENTATION_TRANSPOSE:
+        thumbnail = thumbnail.transpose(getattr(Image, ORIENTATION_TRANSPOSE[orientation]))
+    return thumbnail
+
+def compute_pcp_hash(im):
+    # Calculates hash of a grayscale thumbnail: each bit is set if the pixel
+    # is brighter than the average one. Rows are stored as big-endian
+    # PCP_BITS_PER_ROW-bit numbers, leftmost pixel is the most significant bit.
     width, height = im.size
 
     if width != height:
         raise Exception('Width != height')
 
-    sum = 0
-
-    for y in range(0, height):
-        for x in range(0, width):
-            pixel = im.getpixel((x, y))
-            sum += pixel
-
-    average = sum / (width*height)
-
-    hash = list()
-
-    for y in range(0, width):
-        bits = 0
-        for x in range(0, height):
-            bit = int(im.getpixel((x, y)) > average)
-            bits += bit * math.pow(2, PCP_BITS_PER_ROW - 1 - x)
-
-        hash.append(int(bits))
+    pixels = im.tobytes()
+    total = sum(pixels)
+    # pixel > total / count, compared in integers to avoid rounding
+    count = width * height
+    table = [255 if p * count > total else 0 for p in range(256)]
 
-    # We need (PCP_BITS_PER_ROW / 8 * 2) symbols to store a row as a hex string
-    # It's (PCP_BITS_PER_ROW / 8) bytes, and 2 characters per byte ('00' - 'ff')
-    format_str = '%.{}x'.format(int(PCP_BITS_PER_ROW / 8 * 2))
-    hash_as_str = ''.join([format_str % i for i in hash])
+    # Mode "1" images are packed as 8 pixels per byte, MSB first, so the
+    # raw bytes are exactly the hash rows
+    return im.point(table, '1').tobytes().hex()
 
-    with open(get_hash_filename(md5_hash), 'wt') as f:
-        f.write(hash_as_str)
+def calculate_pcp_hash(filename):
+    # Returns perceptual hash of the image without using the cache
+    try:
+        with stats.stage('pcp_hash'):
+            return compute_pcp_hash(get_thumbnail(filename))
+    except (OSError, SyntaxError, ValueError):
+        # Pillow raises these for unknown, truncated or broken images
+        return None
 
-    os.system('rm %s/%s.png' % (get_pcp_hash_dir(), md5_hash))
+def get_pcp_hash(filename):
+    # TODO
+    # Consider referring to this for more optimal algorithm
+    # http://www.ruanyifeng.com/blog/2011/07/imgHash.txt?spm=a2c65.11461447.0.0.1c8c3588zsrYlA&file=imgHash.txt
 
-    return hash_as_str
+    # Imported here since hash_index depends on this module
+    from organize.hash_index import get_index
+    return get_index().get_pcp_hash(filename)
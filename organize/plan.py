@@ -0,0 +1,293 @@
+# Moving files right away or planning the moves for later
+#
+# App makes its decisions through an actions object. FileActions changes the
+# file system immediately. PlannedActions only records operations and keeps
+# track of how the file system would look after them, so later decisions
+# are the same as if the operations had been done. apply_plan() executes a
+# recorded plan.
+
+import os
+import json
+import errno
+import shutil
+import logging
+
+from organize.utils import get_free_filename
+from organize.stats import stats
+
+logger = logging.getLogger("organize")
+
+class FileActions():
+
+    def __init__(self, namespace):
+        # DestinationIndex of the destination folder
+        self.namespace = namespace
+
+    def physical(self, path):
+        # Returns the file whose contents path has, None if there is no such file
+        return path if self.namespace.exists(path) else None
+
+    def exists(self, path):
+        return self.namespace.exists(path)
+
+    def get_free_filename(self, dst):
+        return self.namespace.get_free_filename(dst)
+
+    def makedirs(self, path):
+        self.namespace.makedirs(path)
+
+    def move(self, src, dst):
+        # Returns the name the file was moved to, which differs from dst if
+        # another process created dst after the destination was listed
+        logger.info('MV %s -> %s', src, dst)
+        target = dst
+        with stats.stage('move'):
+            while True:
+                try:
+                    move_file(src, target)
+                    break
+                except FileExistsError:
+                    self.namespace.refresh(os.path.dirname(dst))
+                    target = self.namespace.get_free_filename(dst)
+                    logger.warning("%s was created meanwhile, moving %s to %s instead",
+                                   dst, src, target)
+        self.namespace.discard(src)
+        self.namespace.add(target)
+        return target
+
+    def remove(self, path):
+        logger.info('RM %s', path)
+        with stats.stage('remove'):
+            os.remove(path)
+        self.namespace.discard(path)
+
+    def close(self):
+        pass
+
+class PlannedActions():
+
+    def __init__(self, namespace, filename):
+        self.namespace = namespace
+        self.filename = filename
+        self.operations = []
+        # path -> file which will be there after the plan is applied, or None
+        self.planned = {}
+        # dst -> index of the operation moving a file there
+        self.moves = {}
+
+    def physical(self, path):
+        if path in self.planned:
+            return self.planned[path]
+        return path if self.namespace.exists(path) else None
+
+    def exists(self, path):
+        return self.physical(path) is not None
+
+    def get_free_filename(self, dst):
+        return get_free_filename(dst, self.exists)
+
+    def makedirs(self, path):
+        # Directories are created by apply_plan()
+        pass
+
+    def move(self, src, dst):
+        logger.info('MV %s -> %s', src, dst)
+        self.moves[dst] = len(self.operations)
+        self.operations.append({'op': 'move', 'src': self.physical(src), 'dst': dst})
+        self.planned[dst] = self.physical(src)
+        self.planned[src] = None
+        return dst
+
+    def remove(self, path):
+        logger.info('RM %s', path)
+        source = self.physical(path)
+        if path in self.moves:
+            # The file was not moved yet, so it's removed at its current place
+            self.operations[self.moves.pop(path)] = {'op': 'remove', 'path': source}
+        else:
+            self.operations.append({'op': 'remove', 'path': path})
+        self.planned[path] = None
+
+    def close(self):
+        with open(self.filename, 'wt') as f:
+            for operation in self.operations:
+                f.write(json.dumps(operation) + '\n')
+        logger.info("Plan with %d operations written to %s", len(self.operations), self.filename)
+
+def read_plan(filename):
+    with open(filename, 'rt') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def get_device(path, cache):
+    # Returns device of the nearest existing directory containing path
+    path = os.path.dirname(os.path.abspath(path))
+    if path not in cache:
+        try:
+            cache[path] = os.stat(path).st_dev
+        except FileNotFoundError:
+            cache[path] = get_device(path, cache)
+    return cache[path]
+
+def copy_data(fsrc, fdst):
+    # Copies file contents in the kernel where possible, raises OSError if
+    # less than the whole file was copied
+    size = os.fstat(fsrc.fileno()).st_size
+    copied = 0
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                         errno.EOPNOTSUPP):
+                raise
+
+    if copied < size:
+        try:
+            while copied < size:
+                n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except (AttributeError, OSError):
+            # sendfile() may only support sockets as output
+            pass
+
+    if copied < size:
+        # Some file systems copy nothing or only a part in the kernel, the
+        # rest is copied from where the kernel stopped
+        fsrc.seek(copied)
+        fdst.seek(copied)
+        shutil.copyfileobj(fsrc, fdst)
+        copied = fdst.tell()
+
+    if copied < size:
+        raise OSError(errno.EIO, 'Only %d of %d bytes copied' % (copied, size), fsrc.name)
+
+def copy_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        try:
+            copy_data(fsrc, fdst)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        except:
+            # An incomplete copy would block the move when it's retried
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def rename_file(src, dst):
+    # Renames src to dst, raises FileExistsError instead of replacing dst.
+    # A hard link can't be created over an existing file, so another process
+    # creating dst between a check and the rename can't make us replace it.
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            raise
+        # The file system has no hard links
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.remove(src)
+
+def move_file(src, dst):
+    # Moves src to dst, across devices too, never replacing dst
+    try:
+        rename_file(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_file(src, dst)
+        os.remove(src)
+
+def fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def apply_group(operations):
+    # Applies operations on a single device, returns destinations of moves done
+    created = set()
+    synced = set()
+    copied = []
+    moved = []
+
+    for operation in operations:
+        try:
+            if operation['op'] == 'remove':
+                logger.info('RM %s', operation['path'])
+                os.remove(operation['path'])
+                synced.add(os.path.dirname(operation['path']))
+                continue
+
+            src, dst = operation['src'], operation['dst']
+            parent = os.path.dirname(dst)
+            if parent not in created:
+                os.makedirs(parent, exist_ok=True)
+                created.add(parent)
+            if os.path.lexists(dst):
+                logger.error("%s already exists, not overwriting it with %s", dst, src)
+                continue
+
+            logger.info('MV %s -> %s', src, dst)
+            try:
+                rename_file(src, dst)
+                synced.add(os.path.dirname(src))
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                copy_file(src, dst)
+                copied.append((src, dst))
+            synced.add(parent)
+            moved.append(dst)
+        except OSError as e:
+            logger.error("Could not apply %s: %s", operation, e)
+
+    # Sources of copies are removed only after the copies are on disk
+    for path in synced:
+        fsync_dir(path)
+
+    synced = set()
+    for src, dst in copied:
+        try:
+            if os.stat(dst).st_size != os.stat(src).st_size:
+                logger.error("%s differs in size from %s, keeping %s", dst, src, src)
+                continue
+            os.remove(src)
+        except OSError as e:
+            logger.error("Could not remove %s: %s", src, e)
+            continue
+        synced.add(os.path.dirname(src))
+    for path in synced:
+        fsync_dir(path)
+
+    return moved
+
+def apply_plan(filename):
+    # Operations are grouped by the device they write to, the order of
+    # operations within a group is kept
+    groups = {}
+    devices = {}
+    for operation in read_plan(filename):
+        path = operation['dst'] if operation['op'] == 'move' else operation['path']
+        groups.setdefault(get_device(path, devices), []).append(operation)
+
+    moved = []
+    for operations in groups.values():
+        moved.extend(apply_group(operations))
+    return moved
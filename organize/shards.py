@@ -0,0 +1,240 @@
+# Sharded hash index
+#
+# Every storage node hashes its own files into a shard: a compact file of
+# (md5, perceptual hash, size, path) records sorted by md5. Shards of all
+# nodes are then merged by streaming them side by side, so files with the
+# same md5 come out one after another and exact duplicates are found
+# holding one group in memory. Near duplicates are found with the same
+# chunks as HammingIndex uses: records are externally sorted by each chunk
+# in turn, and only records sharing a chunk value are compared. Records
+# sharing a chunk are sorted by the whole hash, and each one is compared
+# with a window of the preceding ones, so a chunk value common to a lot of
+# images costs linear time and bounded memory instead of quadratic time.
+# Equal hashes are next to each other in that order, but close ones are
+# not necessarily, so in such crowded groups some near duplicates may be
+# missed.
+#
+# Shard file format, all integers are little endian:
+#
+#   magic 'PCPS', version (uint32), node name length (uint16), node name
+#   records: md5 (16 bytes), perceptual hash (32 bytes, zeros if unknown),
+#            size (uint64), path length (uint16), path
+
+import os
+import heapq
+import pickle
+import struct
+import logging
+import tempfile
+from itertools import groupby
+from collections import deque
+
+from organize.pcp_hash import PCP_HASH_SIZE
+from organize.hasharray import pack_hash, unpack_hash, popcount, to_int
+from organize.hamming import get_chunks
+from organize.walker import walk
+
+logger = logging.getLogger("organize")
+
+MAGIC = b'PCPS'
+VERSION = 1
+HEADER = struct.Struct('<4sIH')
+RECORD = struct.Struct('<16s%dsQH' % (PCP_HASH_SIZE // 8))
+
+# Number of items sorted in memory at once by sort_external()
+RUN_SIZE = 100000
+
+# Number of preceding records sharing a chunk each record is compared with,
+# in the order of hashes as numbers
+BUCKET_WINDOW = 1000
+
+# Files perceptual hashes are calculated for
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+def sort_external(items, key=None, run_size=RUN_SIZE):
+    # Yields items sorted by key. Items are sorted in runs of run_size,
+    # which are spilled to temporary files and merged, so memory use
+    # doesn't depend on the number of items.
+    runs = []
+    try:
+        run = []
+        for item in items:
+            run.append(item)
+            if len(run) == run_size:
+                runs.append(write_run(sorted(run, key=key)))
+                run = []
+        run.sort(key=key)
+
+        if not runs:
+            yield from run
+            return
+
+        runs.append(write_run(run))
+        yield from heapq.merge(*[read_run(f) for f in runs], key=key)
+    finally:
+        for f in runs:
+            f.close()
+
+def write_run(items):
+    f = tempfile.TemporaryFile()
+    for item in items:
+        pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+def read_run(f):
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+class ShardWriter():
+
+    def __init__(self, filename, node):
+        self.f = open(filename, 'wb')
+        name = node.encode('utf-8')
+        self.f.write(HEADER.pack(MAGIC, VERSION, len(name)))
+        self.f.write(name)
+
+    def write(self, md5, size, pcp, path):
+        # md5 and pcp are hex strings, pcp may be None
+        path = os.fsencode(path)
+        pcp = pack_hash(pcp) if pcp is not None else bytes(PCP_HASH_SIZE // 8)
+        self.f.write(RECORD.pack(bytes.fromhex(md5), pcp, size, len(path)))
+        self.f.write(path)
+
+    def close(self):
+        self.f.close()
+
+class Shard():
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise ValueError('%s is not a shard' % filename)
+            magic, version, length = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('%s is not a shard' % filename)
+            self.node = f.read(length).decode('utf-8')
+        self.offset = HEADER.size + length
+
+    def __iter__(self):
+        # Yields (md5, size, pcp, node, path) in md5 order, pcp is None if
+        # it's unknown
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                data = f.read(RECORD.size)
+                if not data:
+                    return
+                if len(data) != RECORD.size:
+                    raise ValueError('%s is truncated' % self.filename)
+                md5, pcp, size, length = RECORD.unpack(data)
+                path = f.read(length)
+                if len(path) != length:
+                    raise ValueError('%s is truncated' % self.filename)
+                path = os.fsdecode(path)
+                pcp = unpack_hash(pcp) if any(pcp) else None
+                yield md5.hex(), size, pcp, self.node, path
+
+def build_shard(paths, node, filename, index):
+    # Hashes all files under paths and writes them to a shard, hashes are
+    # taken from the index when they are known
+    def get_records():
+        for path in paths:
+            for entry in walk(path):
+                try:
+                    st = entry.stat()
+                    md5 = index.get_file_hash(entry.path, st)
+                except OSError as e:
+                    logger.error("Could not read %s: %s", entry.path, e)
+                    continue
+                pcp = None
+                if entry.name.lower().endswith(IMAGE_SUFFIXES):
+                    pcp = index.get_pcp_hash(entry.path, md5)
+                yield md5, os.path.abspath(entry.path), st.st_size, pcp
+
+    writer = ShardWriter(filename, node)
+    count = 0
+    try:
+        for md5, path, size, pcp in sort_external(get_records(), key=lambda r: r[:2]):
+            writer.write(md5, size, pcp, path)
+            count += 1
+    finally:
+        writer.close()
+    logger.info("%d files written to shard %s", count, filename)
+    return count
+
+def merge_shards(shards):
+    # Yields records of all shards in md5 order
+    return heapq.merge(*shards, key=lambda record: record[0])
+
+def find_exact_duplicates(shards):
+    # Yields lists of records with the same md5
+    for md5, records in groupby(merge_shards(shards), key=lambda record: record[0]):
+        records = list(records)
+        if len(records) > 1:
+            yield records
+
+def find_near_duplicates(shards, max_distance, window=BUCKET_WINDOW):
+    # Yields clusters (lists of records) of files whose perceptual hashes
+    # are within max_distance from each other, directly or through other
+    # files. Files with the same md5 are not compared, they are exact
+    # duplicates. Files are numbered in merge order, and only numbers of
+    # files having near duplicates are kept in memory; their records are
+    # read again and grouped by cluster on disk at the end.
+    parent = {}
+
+    def find(id_):
+        while parent[id_] != id_:
+            parent[id_] = parent[parent[id_]]
+            id_ = parent[id_]
+        return id_
+
+    def union(id1, id2):
+        parent.setdefault(id1, id1)
+        parent.setdefault(id2, id2)
+        root1, root2 = find(id1), find(id2)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+
+    def get_items(shift, mask):
+        for id_, record in enumerate(merge_shards(shards)):
+            if record[2] is None:
+                continue
+            value = to_int(record[2])
+            # A hash without bits set belongs to a uniform image
+            if value == 0:
+                continue
+            yield (value >> shift) & mask, value, id_, record[0]
+
+    crowded = 0
+    for shift, mask in get_chunks(max_distance):
+        items = sort_external(get_items(shift, mask), key=lambda item: item[:2])
+        for chunk, bucket in groupby(items, key=lambda item: item[0]):
+            previous = deque(maxlen=window)
+            count = 0
+            for _, value1, id1, md5_1 in bucket:
+                for value2, id2, md5_2 in previous:
+                    if md5_1 != md5_2 and popcount(value1 ^ value2) <= max_distance:
+                        union(id1, id2)
+                previous.append((value1, id1, md5_1))
+                count += 1
+            if count > window:
+                crowded += 1
+    if crowded:
+        logger.warning("%d groups of images sharing a part of the hash had more than %d images, "
+                       "each image was compared with %d of them only, some near duplicates "
+                       "may be missed", crowded, window, window)
+
+    def get_members():
+        for id_, record in enumerate(merge_shards(shards)):
+            if id_ in parent:
+                yield find(id_), record
+
+    members = sort_external(get_members(), key=lambda member: member[0])
+    for root, cluster in groupby(members, key=lambda member: member[0]):
+        yield sorted((record for root, record in cluster), key=lambda record: record[3:])
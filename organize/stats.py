@@ -0,0 +1,114 @@
+# Per-stage instrumentation
+#
+# Collects wall and CPU time of pipeline stages and event counters (bytes
+# read, subprocesses, cache hits). When disabled, stage() returns a shared
+# no-op context manager and count() returns right away, so instrumented
+# code pays one attribute check.
+
+import json
+import time
+
+# Upper bounds of wall time histogram buckets, in seconds
+HISTOGRAM_BOUNDS = (0.001, 0.01, 0.1, 1.0, 10.0)
+
+class NullTimer():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Timer():
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.wall,
+                            time.process_time() - self.cpu)
+        return False
+
+def new_stage():
+    return {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'max': 0.0,
+            'histogram': [0] * (len(HISTOGRAM_BOUNDS) + 1)}
+
+class Stats():
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, wall, cpu):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = new_stage()
+        stage['count'] += 1
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        stage['max'] = max(stage['max'], wall)
+        bucket = 0
+        while bucket < len(HISTOGRAM_BOUNDS) and wall > HISTOGRAM_BOUNDS[bucket]:
+            bucket += 1
+        stage['histogram'][bucket] += 1
+
+    def take(self):
+        # Returns collected data and starts over, used to pass data
+        # from worker processes
+        result = {'stages': self.stages, 'counters': self.counters}
+        self.stages = {}
+        self.counters = {}
+        return result
+
+    def merge(self, data):
+        for name, other in data['stages'].items():
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = new_stage()
+            stage['count'] += other['count']
+            stage['wall'] += other['wall']
+            stage['cpu'] += other['cpu']
+            stage['max'] = max(stage['max'], other['max'])
+            stage['histogram'] = [a + b for a, b in zip(stage['histogram'], other['histogram'])]
+        for name, value in data['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        return {'histogram_bounds': HISTOGRAM_BOUNDS, 'stages': self.stages,
+                'counters': self.counters}
+
+    def report(self):
+        lines = ['%-16s %8s %10s %10s %10s  %s' % ('stage', 'count', 'wall, s', 'cpu, s', 'max, s',
+                                                    'histogram (<1ms <10ms <100ms <1s <10s more)')]
+        for name, stage in sorted(self.stages.items(), key=lambda i: -i[1]['wall']):
+            lines.append('%-16s %8d %10.3f %10.3f %10.3f  %s' %
+                         (name, stage['count'], stage['wall'], stage['cpu'], stage['max'],
+                          ' '.join(str(i) for i in stage['histogram'])))
+        for name, value in sorted(self.counters.items()):
+            lines.append('%-16s %8d' % (name, value))
+        return '\n'.join(lines)
+
+    def write(self, filename):
+        with open(filename, 'wt') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+# Statistics of the current process
+stats = Stats()
@@ -0,0 +1,163 @@
+# Creation time of MP4/MOV/3GP videos
+#
+# Walks ISO base media file format boxes by seeking over them and reads only
+# moov/mvhd and QuickTime metadata, so even for multi-gigabyte clips only a
+# few kilobytes are read.
+
+import os
+import re
+import struct
+from datetime import datetime as dt
+
+from organize.stats import stats
+
+# Extensions of files in ISO base media file format
+VIDEO_EXTENSIONS = ('mp4', 'mov', '3gp', 'm4v')
+
+# Seconds between 1904-01-01 (QuickTime epoch) and 1970-01-01
+QUICKTIME_EPOCH_OFFSET = 2082844800
+
+# Creation times before this are left by devices without a clock
+MIN_CREATION_TIME = dt(1990, 1, 1)
+
+# Maximum size of a metadata box we read
+MAX_META_SIZE = 64 * 1024
+
+CREATION_DATE_KEY = b'com.apple.quicktime.creationdate'
+
+class VideoError(Exception):
+    pass
+
+def is_video(filename):
+    return filename.split('.')[-1].lower() in VIDEO_EXTENSIONS
+
+def read_exact(f, size):
+    data = f.read(size)
+    stats.count('bytes_read', len(data))
+    if len(data) != size:
+        raise VideoError('Unexpected end of file')
+    return data
+
+def iter_boxes(f, start, end):
+    # Yields (type, payload offset, payload size) of boxes between start and end
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', read_exact(f, 8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', read_exact(f, 8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise VideoError('Invalid box size')
+        yield kind, pos + header, size - header
+        pos += size
+
+def parse_creation_date(value):
+    # Parses ISO 8601 date like 2019-05-01T12:30:15+0300, the time is local
+    # to where the video was taken, so the zone is dropped
+    m = re.match(r'^(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})', value)
+    if m is None:
+        return None
+    try:
+        return dt.strptime('%s %s' % m.groups(), '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+def read_mvhd(f, offset, size):
+    data = read_exact(f, min(size, 20))
+    version = data[0]
+    if version == 1:
+        created = struct.unpack('>Q', data[4:12])[0]
+    else:
+        created = struct.unpack('>I', data[4:8])[0]
+    if created <= QUICKTIME_EPOCH_OFFSET:
+        return None
+    try:
+        return dt.fromtimestamp(created - QUICKTIME_EPOCH_OFFSET)
+    except (ValueError, OverflowError, OSError):
+        # Far beyond the range of datetime, a corrupt box
+        return None
+
+def read_meta(data):
+    # Returns value of the creation date key from keys/ilst boxes of QuickTime meta
+    if data[:4] == b'\0\0\0\0':
+        # MP4 meta is a full box, QuickTime one is not
+        data = data[4:]
+
+    keys = []
+    values = {}
+    pos = 0
+    while pos + 8 <= len(data):
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        if size < 8:
+            break
+        payload = data[pos + 8:pos + size]
+        if kind == b'keys':
+            count = struct.unpack_from('>I', payload, 4)[0]
+            kpos = 8
+            # Every key takes 8 bytes at least, a larger count is corrupt
+            for i in range(min(count, (len(payload) - kpos) // 8)):
+                ksize = struct.unpack_from('>I', payload, kpos)[0]
+                if ksize < 8 or kpos + ksize > len(payload):
+                    break
+                keys.append(payload[kpos + 8:kpos + ksize])
+                kpos += ksize
+        elif kind == b'ilst':
+            ipos = 0
+            while ipos + 8 <= len(payload):
+                isize, index = struct.unpack_from('>II', payload, ipos)
+                if isize < 8:
+                    break
+                item = payload[ipos + 8:ipos + isize]
+                # item contains a "data" box: size, type, type indicator, locale, value
+                if item[4:8] == b'data':
+                    values[index] = item[16:struct.unpack_from('>I', item)[0]]
+                ipos += isize
+        pos += size
+
+    for i, key in enumerate(keys):
+        if key == CREATION_DATE_KEY and i + 1 in values:
+            return values[i + 1].decode('utf-8', 'replace')
+    return None
+
+def find_creation_time(f, start, end):
+    # Returns (QuickTime creation date, mvhd creation time) found under moov
+    creation_date = None
+    created = None
+    for kind, offset, size in iter_boxes(f, start, end):
+        if kind == b'mvhd':
+            created = read_mvhd(f, offset, size)
+        elif kind == b'meta' and size <= MAX_META_SIZE:
+            f.seek(offset)
+            value = read_meta(read_exact(f, size))
+            if value is not None:
+                creation_date = parse_creation_date(value)
+        elif kind == b'\xa9day' and size <= 256:
+            # QuickTime user data string: length, language and the date
+            f.seek(offset)
+            date = parse_creation_date(read_exact(f, size)[4:].decode('utf-8', 'replace'))
+            creation_date = creation_date or date
+        elif kind == b'udta':
+            date, time = find_creation_time(f, offset, offset + size)
+            creation_date = creation_date or date
+    return creation_date, created
+
+def read_creation_time(filename):
+    # Returns time the video was taken or None
+    try:
+        with stats.stage('video'), open(filename, 'rb') as f:
+            end = os.fstat(f.fileno()).st_size
+            for kind, offset, size in iter_boxes(f, 0, end):
+                if kind == b'moov':
+                    creation_date, created = find_creation_time(f, offset, offset + size)
+                    # QuickTime creation date is in local time, the same as EXIF
+                    for value in (creation_date, created):
+                        if value is not None and value >= MIN_CREATION_TIME:
+                            return value
+                    return None
+    except (OSError, VideoError, struct.error, IndexError, ValueError, OverflowError):
+        return None
+    return None
@@ -0,0 +1,69 @@
+# Directory tree walker
+#
+# Lists directories with os.scandir() in a bounded thread pool, so listing
+# of the next directories overlaps with processing of the current one,
+# which matters on network file systems. Files are yielded as os.DirEntry
+# objects in the same order os.walk() would give them; the stat data cached
+# by scandir comes along for free.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of directories listed at the same time
+DEFAULT_JOBS = 8
+
+# Number of directories listed ahead per thread
+PREFETCH_FACTOR = 4
+
+def list_dir(path, suffixes):
+    # Returns (subdirectories, files) of path. Files are filtered by name
+    # before anything else is done with them.
+    dirs = []
+    files = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif suffixes is None or entry.name.lower().endswith(suffixes):
+                        if entry.is_file():
+                            files.append(entry)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return dirs, files
+
+def is_inside(path, directory):
+    # Whether path is directory itself or anything under it
+    path = os.path.abspath(path)
+    directory = os.path.abspath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def walk(top, suffixes=None, jobs=DEFAULT_JOBS, exclude=None):
+    # Yields os.DirEntry of every file under top whose lowercase name ends
+    # with one of suffixes. Nothing under directory exclude is yielded,
+    # even if it's top itself.
+    if suffixes is not None:
+        suffixes = tuple(s.lower() for s in suffixes)
+    if exclude is not None:
+        exclude = os.path.abspath(exclude)
+        if is_inside(top, exclude):
+            return
+
+    with ThreadPoolExecutor(jobs) as pool:
+        # Depth first, the next directory to visit is at the end,
+        # items are [path, future]
+        stack = [[top, None]]
+        while stack:
+            for item in stack[-jobs * PREFETCH_FACTOR:]:
+                if item[1] is None:
+                    item[1] = pool.submit(list_dir, item[0], suffixes)
+
+            path, future = stack.pop()
+            dirs, files = future.result()
+            yield from files
+
+            stack.extend([d, None] for d in reversed(dirs)
+                         if exclude is None or not is_inside(d, exclude))
@@ -0,0 +1,223 @@
+# Watching a folder for new files
+#
+# New files are reported by inotify on Linux, by polling directory mtimes
+# elsewhere. A file is considered complete once its size and mtime haven't
+# changed for a while, so files still being written are not processed.
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+logger = logging.getLogger("organize")
+
+# Seconds a file should stay unchanged before it's processed
+DEFAULT_SETTLE_TIME = 2.0
+
+# Seconds between directory scans of PollingWatcher
+DEFAULT_POLL_INTERVAL = 5.0
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+def scan_tree(path):
+    # Returns lists of all directories and files under path
+    dirs = []
+    files = []
+    for root, subdirs, names in os.walk(path):
+        dirs.append(root)
+        files.extend(os.path.join(root, name) for name in names)
+    return dirs, files
+
+class InotifyWatcher():
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.path = path
+        self.dirs = {}
+        dirs = scan_tree(path)[0]
+        if not dirs or not self.add_watch(dirs[0]):
+            self.close()
+            raise OSError(errno.ENOENT, 'Could not watch', path)
+        for root in dirs[1:]:
+            self.add_watch(root)
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_watch(self, path):
+        # Returns False if the directory can't be watched, it may have been
+        # removed or made unreadable since it was found
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            logger.warning("Could not watch %s: %s", path, os.strerror(ctypes.get_errno()))
+            return False
+        self.dirs[wd] = path
+        return True
+
+    def poll(self, timeout):
+        # Returns list of files changed during timeout seconds
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        files = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b'\0')
+            pos += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("Too many events, rescanning %s", self.path)
+                return scan_tree(self.path)[1]
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if wd not in self.dirs:
+                continue
+
+            filename = os.path.join(self.dirs[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files could appear before the watch is added
+                    dirs, new_files = scan_tree(filename)
+                    for path in dirs:
+                        self.add_watch(path)
+                    files.extend(new_files)
+            else:
+                files.append(filename)
+
+        return files
+
+class PollingWatcher():
+
+    def __init__(self, path, interval=DEFAULT_POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.dirs = {}
+        for root in scan_tree(path)[0]:
+            self.dirs[root] = self.get_mtime(root)
+
+    def close(self):
+        pass
+
+    def get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def poll(self, timeout):
+        # Returns files of directories changed since the last call. Only
+        # directory mtimes are checked, so the cost is proportional to the
+        # number of directories, not files.
+        time.sleep(min(timeout, self.interval))
+        files = []
+        for path, mtime in list(self.dirs.items()):
+            new_mtime = self.get_mtime(path)
+            if new_mtime == mtime:
+                continue
+            if new_mtime is None:
+                del self.dirs[path]
+                continue
+            self.dirs[path] = new_mtime
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.dirs:
+                                dirs, new_files = scan_tree(entry.path)
+                                self.dirs.update((d, self.get_mtime(d)) for d in dirs)
+                                files.extend(new_files)
+                        else:
+                            files.append(entry.path)
+            except OSError as e:
+                # Removed or made unreadable since its mtime was checked
+                logger.warning("Could not list %s: %s", path, e)
+                del self.dirs[path]
+        return files
+
+class Debouncer():
+
+    def __init__(self, settle_time=DEFAULT_SETTLE_TIME):
+        self.settle_time = settle_time
+        # filename -> (size, mtime_ns, time since when they are the same)
+        self.files = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def touch(self, filename):
+        # Restarts waiting for the file
+        self.files[filename] = (None, None, time.monotonic())
+
+    def ready(self):
+        # Returns files which haven't changed for settle_time seconds
+        now = time.monotonic()
+        result = []
+        for filename, (size, mtime_ns, since) in list(self.files.items()):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                del self.files[filename]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.files[filename] = (st.st_size, st.st_mtime_ns, now)
+            elif now - since >= self.settle_time:
+                del self.files[filename]
+                result.append(filename)
+        return sorted(result)
+
+def create_watcher(path, polling=False):
+    if not polling:
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            logger.warning("Could not use inotify (%s), falling back to polling", e)
+    return PollingWatcher(path)
+
+def watch(watcher, filter_func, settle_time=DEFAULT_SETTLE_TIME, on_batch=None):
+    # Yields new files reported by watcher forever, once they are completely
+    # written, and closes the watcher when done. on_batch() is called before
+    # each batch of ready files.
+    debouncer = Debouncer(settle_time)
+    try:
+        while True:
+            # Wake up regularly to check pending files
+            timeout = settle_time / 2 if len(debouncer) else 60.0
+            for filename in watcher.poll(timeout):
+                if filter_func(filename):
+                    debouncer.touch(filename)
+            ready = debouncer.ready()
+            if ready and on_batch is not None:
+                on_batch()
+            yield from ready
+    finally:
+        watcher.close()
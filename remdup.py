@@ -8,57 +8,51 @@ import os
 import sys
 import argparse
 
-from organize.pcp_hash import get_file_hash, get_pcp_hash, get_file_size
+from organize.cli import setup_logging
+from organize.hash_index import get_index
+from organize.dedupe import find_duplicates
+from organize.walker import walk, is_inside
 
 class App():
 
-    src_hashes = {}
-    dst_hashes = {}
-
     def __init__(self):
+        setup_logging()
         parser = argparse.ArgumentParser(description='Duplicate remove tool')
         parser.add_argument('--src', type=str, help='Path', required=False)
         parser.add_argument('--dst', type=str, help='Destination', required=False)
+        parser.add_argument('--near', action='store_true', default=False,
+                            help='Also remove images with similar perceptual hashes')
+        parser.add_argument('--max-distance', type=int, default=0,
+                            help='Maximum number of different bits of perceptual hashes of '
+                                 'similar images, implies --near')
         self.args = parser.parse_args()
 
         self.args.src = os.path.expanduser(self.args.src)
         self.args.dst = os.path.expanduser(self.args.dst)
 
-    def build_hash(self, path, ignore_path=None):
-        result = {}
-        for root, dirs, files in os.walk(path):
-            for file in files:
-                print(file)
-                if not file.split('.')[-1].lower() in ['jpg', 'jpeg', 'png']:
-                    continue
-
-                filename = os.path.join(root, file)
-
-                if ignore_path is not None and filename.startswith(ignore_path):
-                    continue
+        self.index = get_index()
 
-                hash = get_pcp_hash(filename)
-
-                if hash in result.keys():
-                    result[hash].append(filename)
-                else:
-                    result[hash] = [filename]
-
-        return result
+    def get_files(self, path, other):
+        # Files of the other side are left out when it's nested in path. When
+        # both are the same folder, every file is skipped by find_duplicates()
+        # as a duplicate of itself.
+        exclude = None
+        if is_inside(other, path) and os.path.abspath(other) != os.path.abspath(path):
+            exclude = other
+        for entry in walk(path, ('.jpg', '.jpeg', '.png'), exclude=exclude):
+            yield entry.path
 
     def run(self):
+        src_files = self.get_files(self.args.src, self.args.dst)
+        dst_files = self.get_files(self.args.dst, self.args.src)
 
-        self.src_hashes = self.build_hash(self.args.src)
-        self.dst_hashes = self.build_hash(self.args.dst, self.args.src)
-
-        print(self.src_hashes)
-        print(self.dst_hashes)
+        near = self.args.near or self.args.max_distance > 0
 
-        for hash in self.src_hashes.keys():
-            if hash in self.dst_hashes.keys():
-                print("RM %s: %s" % (hash, self.src_hashes[hash]))
-                for file in self.src_hashes[hash]:
-                    os.remove(file)
+        for src, dst in find_duplicates(src_files, dst_files, self.index, near,
+                                        self.args.max_distance):
+            print("RM %s (duplicates %s)" % (src, dst))
+            for file in src:
+                os.remove(file)
 
 if __name__ == '__main__':
     app = App()
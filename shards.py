@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+Finds duplicates over several storage nodes.
+
+Every node builds a shard of its own files:
+
+    shards.py build --node nas1 --output nas1.shard /volume1/photos
+
+Then shards of all nodes are merged on any machine, duplicate groups are
+written as JSON lines:
+
+    shards.py merge --near --max-distance 4 nas1.shard nas2.shard
+
+Hashes come from the hash index of the node, running hash.py --jobs over
+the same paths first hashes them in parallel.
+"""
+
+import sys
+import json
+import argparse
+
+from organize.cli import setup_logging
+from organize.pcp_hash import PCP_HASH_SIZE
+from organize.hash_index import get_index
+from organize.shards import Shard, build_shard, find_exact_duplicates, find_near_duplicates
+
+def to_json(records):
+    return [{'node': node, 'path': path, 'size': size, 'md5': md5, 'pcp': pcp}
+            for md5, size, pcp, node, path in records]
+
+class App():
+
+    def __init__(self):
+        setup_logging(stream=sys.stderr)
+        parser = argparse.ArgumentParser(description='Distributed duplicate search tool')
+        commands = parser.add_subparsers(dest='command', required=True)
+
+        build = commands.add_parser('build', help='Writes a shard of files of this node')
+        build.add_argument('paths', nargs='+', help='Directories')
+        build.add_argument('--node', type=str, required=True, help='Name of this node')
+        build.add_argument('--output', type=str, required=True, help='Shard file')
+
+        merge = commands.add_parser('merge', help='Finds duplicates in shards')
+        merge.add_argument('shards', nargs='+', help='Shard files')
+        merge.add_argument('--near', action='store_true', default=False,
+                           help='Also finds images with similar perceptual hashes')
+        merge.add_argument('--max-distance', type=int, default=0,
+                           help='Maximum number of different bits of perceptual hashes of '
+                                'similar images, implies --near')
+
+        self.args = parser.parse_args()
+        if self.args.command == 'merge' and not 0 <= self.args.max_distance < PCP_HASH_SIZE:
+            parser.error('--max-distance should be from 0 to %d' % (PCP_HASH_SIZE - 1))
+
+    def build(self):
+        build_shard(self.args.paths, self.args.node, self.args.output, get_index())
+
+    def merge(self):
+        shards = [Shard(filename) for filename in self.args.shards]
+
+        for records in find_exact_duplicates(shards):
+            print(json.dumps({'type': 'exact', 'files': to_json(records)}))
+
+        if self.args.near or self.args.max_distance > 0:
+            for records in find_near_duplicates(shards, self.args.max_distance):
+                print(json.dumps({'type': 'near', 'files': to_json(records)}))
+
+    def run(self):
+        if self.args.command == 'build':
+            self.build()
+        else:
+            self.merge()
+
+if __name__ == '__main__':
+    app = App()
+    sys.exit(app.run())
@@ -0,0 +1,80 @@
+# Staged duplicate detection of remdup.py
+
+import os
+import hashlib
+import tempfile
+import unittest
+
+from organize.dedupe import find_duplicates
+
+class FakeIndex():
+    # Hash index with perceptual hashes given by the test
+
+    def __init__(self, pcp_hashes):
+        self.pcp_hashes = pcp_hashes
+
+    def get_file_hash(self, filename, st=None):
+        with open(filename, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def get_pcp_hash(self, filename):
+        return self.pcp_hashes.get(os.path.basename(filename))
+
+def get_hash(bits):
+    # Returns a 256-bit hash with the given bits set
+    return '%064x' % sum(1 << bit for bit in bits)
+
+class FindDuplicatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.dst = os.path.join(self.tmp.name, 'dst')
+        os.makedirs(self.src)
+        os.makedirs(self.dst)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_file(self, path, name, data):
+        filename = os.path.join(path, name)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+
+    def test_exact(self):
+        src = self.write_file(self.src, 'a.jpg', b'same')
+        other = self.write_file(self.src, 'b.jpg', b'diff')
+        dst = self.write_file(self.dst, 'a.jpg', b'same')
+        self.assertEqual(find_duplicates([src, other], [dst], FakeIndex({})), [([src], [dst])])
+
+    def test_same_file(self):
+        # A file is never a duplicate of itself, by path or by hard link
+        filename = self.write_file(self.src, 'a.jpg', b'same')
+        link = os.path.join(self.dst, 'a.jpg')
+        os.link(filename, link)
+        index = FakeIndex({'a.jpg': get_hash([1, 2, 3])})
+        self.assertEqual(find_duplicates([filename], [filename], index, True, 4), [])
+        self.assertEqual(find_duplicates([filename], [link], index, True, 4), [])
+
+    def test_near_is_not_transitive(self):
+        # close.jpg is within 4 bits from the destination image, far.jpg is
+        # within 4 bits from close.jpg only
+        dst = self.write_file(self.dst, 'dst.jpg', b'destination')
+        close = self.write_file(self.src, 'close.jpg', b'close to destination')
+        far = self.write_file(self.src, 'far.jpg', b'close to close.jpg')
+        index = FakeIndex({'dst.jpg': get_hash(range(16)),
+                           'close.jpg': get_hash(range(3, 16)),
+                           'far.jpg': get_hash(range(6, 16))})
+        self.assertEqual(find_duplicates([close, far], [dst], index, True, 4), [([close], [dst])])
+        self.assertEqual(find_duplicates([close, far], [dst], index, False), [])
+
+    def test_near_uniform(self):
+        # Uniform images have hashes without bits set, they match nothing
+        dst = self.write_file(self.dst, 'dst.jpg', b'black')
+        src = self.write_file(self.src, 'src.jpg', b'white')
+        index = FakeIndex({'dst.jpg': get_hash([]), 'src.jpg': get_hash([])})
+        self.assertEqual(find_duplicates([src], [dst], index, True, 4), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# Header-only EXIF reader
+
+import os
+import struct
+import tempfile
+import unittest
+
+from organize.exif import find_segments, read_jpeg_header, ExifError, EXIF_IFD_POINTER
+
+def segment(marker, payload):
+    return bytes([0xff, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+def make_tiff(order, ifd0, exif_ifd=()):
+    # ifd0 and exif_ifd are lists of (tag, type, value), ASCII values
+    # longer than 4 bytes are stored after the IFDs
+    def ifd_size(entries):
+        return 2 + 12 * len(entries) + 4
+
+    ifd0 = list(ifd0)
+    if exif_ifd:
+        ifd0.append((EXIF_IFD_POINTER, 4, None))
+    exif_offset = 8 + ifd_size(ifd0)
+    data_offset = exif_offset + (ifd_size(exif_ifd) if exif_ifd else 0)
+    data = b''
+
+    def pack_ifd(entries):
+        nonlocal data
+        result = struct.pack(order + 'H', len(entries))
+        for tag, field_type, value in entries:
+            count = 1
+            if tag == EXIF_IFD_POINTER:
+                field = struct.pack(order + 'L', exif_offset)
+            elif field_type == 2:
+                value = value.encode('latin-1') + b'\0'
+                count = len(value)
+                if count <= 4:
+                    field = value.ljust(4, b'\0')
+                else:
+                    field = struct.pack(order + 'L', data_offset + len(data))
+                    data += value
+            elif field_type == 3:
+                field = struct.pack(order + 'H', value) + b'\0\0'
+            else:
+                field = struct.pack(order + 'L', value)
+            result += struct.pack(order + 'HHL', tag, field_type, count) + field
+        return result + struct.pack(order + 'L', 0)
+
+    header = (b'II*\0' if order == '<' else b'MM\0*') + struct.pack(order + 'L', 8)
+    ifds = pack_ifd(ifd0) + (pack_ifd(exif_ifd) if exif_ifd else b'')
+    return header + ifds + data
+
+def app1(tiff):
+    return segment(0xe1, b'Exif\0\0' + tiff)
+
+def sof(width, height, marker=0xc0):
+    return segment(marker, struct.pack('>BHHB', 8, height, width, 3) + bytes(9))
+
+def jpeg(*segments):
+    return b'\xff\xd8' + b''.join(segments) + b'\xff\xda\x00\x08' + bytes(1000) + b'\xff\xd9'
+
+TIFF = make_tiff('<', [(0x010f, 2, 'Canon'), (0x0110, 2, 'EOS'), (0x0112, 3, 6)],
+                 [(0x9003, 2, '2019:05:01 12:30:15')])
+EXIF = {'Make': 'Canon', 'Model': 'EOS', 'Orientation': '6',
+        'DateTimeOriginal': '2019:05:01 12:30:15'}
+
+class FindSegmentsTest(unittest.TestCase):
+
+    def test_segments(self):
+        data = jpeg(segment(0xe0, b'JFIF\0' + bytes(9)), app1(TIFF), segment(0xdb, bytes(65)),
+                    sof(4000, 3000))
+        self.assertEqual(find_segments(data), (TIFF, (4000, 3000)))
+
+    def test_sof_markers(self):
+        # DHT (C4) is not a start of frame, progressive SOF2 is
+        data = jpeg(app1(TIFF), segment(0xc4, bytes(30)), sof(640, 480, 0xc2))
+        self.assertEqual(find_segments(data), (TIFF, (640, 480)))
+
+    def test_fill_bytes(self):
+        data = jpeg(app1(TIFF), b'\xff\xff', sof(640, 480))
+        self.assertEqual(find_segments(data), (TIFF, (640, 480)))
+
+    def test_no_exif(self):
+        self.assertEqual(find_segments(jpeg(segment(0xe0, b'JFIF\0'), sof(640, 480))),
+                         (None, (640, 480)))
+        # XMP is stored in APP1 too
+        xmp = segment(0xe1, b'http://ns.adobe.com/xap/1.0/\0<x:xmpmeta/>')
+        self.assertEqual(find_segments(jpeg(xmp, sof(640, 480))), (None, (640, 480)))
+
+    def test_not_jpeg(self):
+        with self.assertRaises(ExifError):
+            find_segments(b'\x89PNG\r\n\x1a\n' + bytes(100))
+
+    def test_invalid_marker(self):
+        with self.assertRaises(ExifError):
+            find_segments(b'\xff\xd8\x00\x00' + bytes(100))
+
+    def test_truncated(self):
+        data = jpeg(app1(TIFF), sof(640, 480))
+        sof_start = 2 + len(app1(TIFF))
+        # The EXIF segment doesn't fit into data
+        for size in (3, 5, 20, sof_start - 1):
+            with self.assertRaises(ExifError):
+                find_segments(data[:size])
+        # EXIF is complete, the size is beyond the end of data
+        for size in (sof_start, sof_start + 4, sof_start + 8):
+            self.assertEqual(find_segments(data[:size]), (TIFF, None))
+        self.assertEqual(find_segments(data[:sof_start + 9]), (TIFF, (640, 480)))
+
+    def test_size_before_exif(self):
+        data = jpeg(sof(640, 480), app1(TIFF))
+        self.assertEqual(find_segments(data), (TIFF, (640, 480)))
+
+class ReadJpegHeaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'a.jpg')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, data, **kwargs):
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+        return read_jpeg_header(self.filename, **kwargs)
+
+    def test_little_endian(self):
+        exif, size = self.read(jpeg(app1(TIFF), sof(4000, 3000)))
+        self.assertEqual({key: exif[key] for key in EXIF}, EXIF)
+        self.assertEqual(size, (4000, 3000))
+
+    def test_big_endian(self):
+        tiff = make_tiff('>', [(0x010f, 2, 'Nikon'), (0x0112, 3, 8),
+                               (0x0132, 2, '2020:01:02 03:04:05')])
+        exif, size = self.read(jpeg(app1(tiff), sof(100, 200)))
+        self.assertEqual(exif, {'Make': 'Nikon', 'Orientation': '8',
+                                'DateTime': '2020:01:02 03:04:05'})
+        self.assertEqual(size, (100, 200))
+
+    def test_no_exif(self):
+        self.assertEqual(self.read(jpeg(sof(640, 480))), ({}, (640, 480)))
+
+    def test_broken_tiff(self):
+        # The size is known even if EXIF can't be parsed
+        self.assertEqual(self.read(jpeg(app1(b'XX*\0' + bytes(20)), sof(640, 480))),
+                         (None, (640, 480)))
+        tiff = TIFF[:4] + struct.pack('<L', 10000) + TIFF[8:]
+        self.assertEqual(self.read(jpeg(app1(tiff), sof(640, 480))), (None, (640, 480)))
+        # A value pointing out of the segment
+        tiff = make_tiff('<', [(0x010f, 2, 'Canon')])
+        tiff = tiff[:18] + struct.pack('<L', 10000) + tiff[22:]
+        self.assertEqual(self.read(jpeg(app1(tiff), sof(640, 480))), (None, (640, 480)))
+
+    def test_limit(self):
+        data = jpeg(segment(0xe2, bytes(1000)), app1(TIFF), sof(640, 480))
+        self.assertEqual(self.read(data, limit=500), (None, None))
+        self.assertEqual(self.read(data, limit=len(data) - 1000)[1], (640, 480))
+
+    def test_missing(self):
+        self.assertEqual(read_jpeg_header(self.filename), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Image metadata read from file headers
+
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from benchmarks.corpus import make_image
+from organize.exif import read_jpeg_header
+from organize.fileinfo import FileInfo
+
+class Loader():
+    # Reads headers the way organize.App does, without the Pillow fallback
+
+    def get_header(self, filename):
+        exif, size = read_jpeg_header(filename)
+        return exif or {}, size
+
+class HeaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, name, image, **kwargs):
+        filename = os.path.join(self.path, name)
+        image.save(filename, **kwargs)
+        return filename
+
+    def test_jpeg_size(self):
+        image = make_image(random.Random(1), 640, 480)
+        exif = Image.Exif()
+        exif[0x010f] = 'Canon'
+        for name, kwargs in (('plain.jpg', {}),
+                             ('exif.jpg', {'exif': exif.tobytes()}),
+                             ('progressive.jpg', {'progressive': True}),
+                             ('big_exif.jpg', {'exif': exif.tobytes() + bytes(60000)})):
+            filename = self.save(name, image, **kwargs)
+            exif_tags, size = read_jpeg_header(filename)
+            self.assertEqual(size, (640, 480), name)
+            self.assertEqual(exif_tags.get('Make'), 'Canon' if 'exif' in kwargs else None, name)
+
+    def test_not_jpeg(self):
+        filename = self.save('image.png', make_image(random.Random(1), 64, 32))
+        self.assertEqual(read_jpeg_header(filename), (None, None))
+
+    def test_jpeg_not_opened(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        filename = self.save('rotated.jpg', make_image(random.Random(1), 640, 480),
+                             exif=exif.tobytes())
+        info = FileInfo(filename, Loader())
+        with mock.patch('PIL.Image.open') as image_open:
+            self.assertEqual(info.size, (480, 640))
+            self.assertEqual(info.format, 'jpeg')
+        image_open.assert_not_called()
+
+    def test_png(self):
+        filename = self.save('image.png', make_image(random.Random(1), 64, 32))
+        info = FileInfo(filename, Loader())
+        self.assertEqual(info.size, (64, 32))
+        self.assertEqual(info.format, 'png')
+
+    def test_failure_remembered(self):
+        filename = os.path.join(self.path, 'broken.png')
+        with open(filename, 'wb') as f:
+            f.write(b'not an image')
+        info = FileInfo(filename, Loader())
+        with mock.patch('PIL.Image.open', side_effect=OSError('broken')) as image_open:
+            for i in range(3):
+                with self.assertRaises(OSError):
+                    info.size
+                with self.assertRaises(OSError):
+                    info.format
+        self.assertEqual(image_open.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
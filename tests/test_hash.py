@@ -0,0 +1,53 @@
+# Hashing of files by hash.py
+
+import os
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+
+import hash
+from organize.hash_index import HashIndex
+
+class HashBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'a.txt')
+        with open(self.filename, 'wb') as f:
+            f.write(b'old')
+        self.app = hash.App.__new__(hash.App)
+        self.app.index = HashIndex(os.path.join(self.tmp.name, 'index.sqlite'))
+
+    def tearDown(self):
+        self.app.index.close()
+        self.tmp.cleanup()
+
+    def test_hash(self):
+        records = list(self.app.hash_batch([self.filename], None))
+        self.assertEqual(records, [{'path': self.filename, 'size': 3,
+                                    'md5': hashlib.md5(b'old').hexdigest(), 'pcp': None}])
+        self.assertEqual(self.app.index.lookup_md5(self.filename), records[0]['md5'])
+
+    def test_file_changed_while_hashed(self):
+        # The file is rewritten after the worker took its stat, the md5 of
+        # the old content must not be stored under the new stat
+        def get_file_hash(filename):
+            md5 = hashlib.md5(b'old').hexdigest()
+            with open(filename, 'wb') as f:
+                f.write(b'new content')
+            return md5
+
+        with mock.patch('hash.get_file_hash', get_file_hash):
+            records = list(self.app.hash_batch([self.filename], None))
+        self.assertEqual(records[0]['size'], 3)
+        self.assertIsNone(self.app.index.lookup_md5(self.filename))
+
+    def test_missing_file(self):
+        missing = os.path.join(self.tmp.name, 'missing.txt')
+        records = list(self.app.hash_batch([missing], None))
+        self.assertEqual([record['path'] for record in records], [missing])
+        self.assertIn('error', records[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# Persistent index of file hashes
+
+import os
+import hashlib
+import tempfile
+import unittest
+
+from organize.hash_index import HashIndex
+
+def write_file(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+class HashIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index = HashIndex(os.path.join(self.tmp.name, 'index.sqlite'))
+        self.files = []
+        for i in range(20):
+            filename = os.path.join(self.tmp.name, '%d.jpg' % i)
+            write_file(filename, b'%d' % i)
+            self.files.append(filename)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_get_file_hash(self):
+        md5 = hashlib.md5(b'0').hexdigest()
+        self.assertEqual(self.index.get_file_hash(self.files[0]), md5)
+        self.assertEqual(self.index.lookup_md5(self.files[0]), md5)
+        write_file(self.files[0], b'changed')
+        self.assertIsNone(self.index.lookup_md5(self.files[0]))
+
+    def test_lookup_many(self):
+        for filename in self.files[:10]:
+            self.index.get_file_hash(filename)
+        link = os.path.join(self.tmp.name, 'link.jpg')
+        os.link(self.files[0], link)
+        write_file(self.files[1], b'changed')
+        missing = os.path.join(self.tmp.name, 'missing.jpg')
+
+        result = self.index.lookup_many(self.files + [link, missing])
+        expected = {filename: hashlib.md5(b'%d' % i).hexdigest()
+                    for i, filename in enumerate(self.files[:10]) if i != 1}
+        expected[link] = expected[self.files[0]]
+        self.assertEqual(result, expected)
+
+    def test_lookup_many_searches(self):
+        # Files are found by the primary key, the table is never scanned
+        for filename in self.files:
+            self.index.get_file_hash(filename)
+        queries = []
+        self.index.conn.set_trace_callback(queries.append)
+        self.index.lookup_many(self.files)
+        self.index.conn.set_trace_callback(None)
+
+        queries = [query for query in queries if query.startswith('SELECT')]
+        self.assertTrue(queries)
+        for query in queries:
+            plan = ' '.join(row[3] for row in self.index.conn.execute('EXPLAIN QUERY PLAN ' + query))
+            self.assertNotIn('SCAN', plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Compact storage and bulk comparison of perceptual hashes
+
+import random
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from organize import hasharray, hamming
+from organize.hasharray import HashArray, popcount, count_bits, import_numpy
+from organize.hamming import HammingIndex
+
+def make_hashes(rng, count):
+    # Random hashes, half of them near duplicates of previous ones
+    hashes = []
+    for i in range(count):
+        if hashes and rng.random() < 0.5:
+            value = rng.choice(hashes)
+            for bit in rng.sample(range(256), rng.randint(0, 40)):
+                value ^= 1 << bit
+        else:
+            value = rng.getrandbits(256)
+        hashes.append(value)
+    return hashes
+
+class HashArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.hashes = make_hashes(rng, 300)
+        self.queries = make_hashes(rng, 10) + self.hashes[:10]
+        self.array = HashArray()
+        self.array.extend(self.hashes)
+
+    def test_items(self):
+        self.assertEqual(len(self.array), len(self.hashes))
+        self.assertEqual(list(self.array), self.hashes)
+        self.assertEqual(self.array[-1], self.hashes[-1])
+        with self.assertRaises(IndexError):
+            self.array[len(self.hashes)]
+
+    @unittest.skipUnless(hasharray.VECTORIZED, 'NumPy is not installed')
+    def test_same_results_with_numpy(self):
+        ids = list(range(0, len(self.hashes), 3))
+        results = {}
+        for vectorized in (False, True):
+            with mock.patch.object(hasharray, 'VECTORIZED', vectorized):
+                results[vectorized] = [(self.array.distances(value), self.array.distances(value, ids),
+                                        self.array.within(value, 20))
+                                       for value in self.queries]
+        self.assertEqual(results[True], results[False])
+        value = self.queries[0]
+        self.assertEqual(results[False][0][0], [popcount(value ^ other) for other in self.hashes])
+
+    @unittest.skipUnless(hasharray.VECTORIZED, 'NumPy is not installed')
+    def test_byte_table(self):
+        # NumPy without bitwise_count() counts bits of every byte in a table
+        import_numpy()
+        numpy = hasharray.numpy
+        rows = numpy.array([[0, 1, 2 ** 64 - 1, 0x8000000000000001]] * 2, dtype=numpy.uint64)
+        expected = count_bits(rows).tolist()
+        with mock.patch.object(hasharray, 'numpy', SimpleNamespace(uint8=numpy.uint8,
+                                                                   int64=numpy.int64)):
+            self.assertEqual(count_bits(rows).tolist(), expected)
+        self.assertEqual(expected, [67, 67])
+
+class HammingIndexTest(unittest.TestCase):
+
+    def test_same_results_with_numpy(self):
+        rng = random.Random(2)
+        hashes = make_hashes(rng, 300)
+        queries = make_hashes(rng, 10) + hashes[:10]
+        for max_distance in (4, 40):
+            expected = [{i: popcount(value ^ other) for i, other in enumerate(hashes)
+                         if popcount(value ^ other) <= max_distance} for value in queries]
+            for vectorized in (False, True):
+                if vectorized and not hasharray.VECTORIZED:
+                    continue
+                with mock.patch.object(hasharray, 'VECTORIZED', vectorized), \
+                        mock.patch.object(hamming, 'VECTORIZED', vectorized):
+                    index = HammingIndex(max_distance)
+                    for i, value in enumerate(hashes):
+                        index.add(value, i)
+                    # Wide chunks are indexed, narrow ones scanned with NumPy
+                    self.assertEqual(index.scan, vectorized and max_distance == 40)
+                    self.assertEqual([index.query_ids(value) for value in queries], expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Run journal skipping what previous runs have done
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from organize.journal import Journal
+
+def write_file(filename, data=b'data'):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.photos = os.path.join(self.src, 'photos')
+        os.makedirs(self.photos)
+        self.good = os.path.join(self.photos, 'good.jpg')
+        self.bad = os.path.join(self.photos, 'bad.jpg')
+        write_file(self.good)
+        write_file(self.bad, b'broken')
+        self.filename = os.path.join(self.tmp.name, 'journal.sqlite')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_once(self, failed=(), extensions=('.jpg',)):
+        # Processes files the way organize.py does: files which don't fail
+        # are moved away. Returns files walk() yielded.
+        journal = Journal(self.filename)
+        journal.start(self.src, incremental=True, filter_key=','.join(extensions))
+        files = []
+        for filename in journal.walk(self.src, lambda filename: filename.endswith(extensions)):
+            files.append(filename)
+            if filename not in failed:
+                os.remove(filename)
+            journal.done(filename, filename in failed)
+        journal.finish()
+        journal.conn.close()
+        return sorted(files)
+
+    def rewrite(self, filename, data):
+        # Rewrites a file in place, the mtime of its folder stays the same
+        st = os.stat(self.photos)
+        write_file(filename, data)
+        os.utime(self.photos, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_unchanged(self):
+        self.assertEqual(self.run_once(failed=[self.bad]), [self.bad, self.good])
+        self.assertEqual(self.run_once(failed=[self.bad]), [])
+
+    def test_failed_file_rewritten(self):
+        self.assertEqual(self.run_once(failed=[self.bad]), [self.bad, self.good])
+        self.rewrite(self.bad, b'fixed')
+        self.assertEqual(self.run_once(), [self.bad])
+        self.assertFalse(os.path.exists(self.bad))
+
+    def test_failed_again(self):
+        self.run_once(failed=[self.bad])
+        self.rewrite(self.bad, b'still broken')
+        self.assertEqual(self.run_once(failed=[self.bad]), [self.bad])
+        self.assertEqual(self.run_once(failed=[self.bad]), [])
+
+    def test_new_file(self):
+        self.run_once(failed=[self.bad])
+        new = os.path.join(self.photos, 'new.jpg')
+        write_file(new)
+        self.assertEqual(self.run_once(failed=[self.bad]), [new])
+
+    def test_filter_changed(self):
+        # Videos were not looked at by the first run, the folder is done
+        # for the next run only if it's given the same filter
+        video = os.path.join(self.photos, 'clip.mp4')
+        write_file(video)
+        self.assertEqual(self.run_once(failed=[self.bad]), [self.bad, self.good])
+        self.assertEqual(self.run_once(failed=[self.bad]), [])
+        self.assertEqual(self.run_once(failed=[self.bad, video], extensions=('.jpg', '.mp4')),
+                         [self.bad, video])
+        self.assertEqual(self.run_once(failed=[self.bad, video], extensions=('.jpg', '.mp4')),
+                         [])
+
+    def test_entries_without_filter(self):
+        # Journals written before filters were recorded are redone once
+        conn = sqlite3.connect(self.filename)
+        conn.executescript('''
+            CREATE TABLE dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL,
+                               subdirs TEXT NOT NULL, run_id INTEGER NOT NULL);
+            CREATE TABLE files (path TEXT PRIMARY KEY, dev INTEGER NOT NULL,
+                                ino INTEGER NOT NULL, size INTEGER NOT NULL,
+                                mtime_ns INTEGER NOT NULL, run_id INTEGER NOT NULL);
+        ''')
+        conn.execute('INSERT INTO dirs VALUES (?, ?, ?, 1)',
+                     (self.photos, os.stat(self.photos).st_mtime_ns, '[]'))
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.run_once(failed=[self.bad]), [self.bad, self.good])
+        self.assertEqual(self.run_once(failed=[self.bad]), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Moving files into the destination by organize.py
+
+import os
+import argparse
+import tempfile
+import unittest
+
+from organize.cli import load_script
+from organize.content_index import ContentIndex
+from organize.fileinfo import FileInfo
+from organize.hash_index import HashIndex
+from organize.namespace import DestinationIndex
+from organize.plan import FileActions, PlannedActions
+
+organize_script = load_script('organize')
+
+def write_file(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+class MoveFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.dst = os.path.join(self.tmp.name, 'dst')
+        os.makedirs(self.dst)
+        # Three copies of a file under different names
+        self.files = [os.path.join(self.src, name) for name in ('a.jpg', 'b.jpg', 'c.jpg')]
+        for filename in self.files:
+            write_file(filename, b'same data')
+        self.plan = os.path.join(self.tmp.name, 'plan.jsonl')
+
+    def tearDown(self):
+        self.app.contents.close()
+        self.app.index.close()
+        self.tmp.cleanup()
+
+    def make_app(self, plan):
+        self.app = organize_script.App.__new__(organize_script.App)
+        self.app.args = argparse.Namespace(dst=self.dst, plan=self.plan if plan else None,
+                                           max_distance=0)
+        self.app.index = HashIndex(os.path.join(self.tmp.name, 'index.sqlite'))
+        self.app.contents = ContentIndex(self.dst, self.app.get_file_hash,
+                                         filename=os.path.join(self.tmp.name, 'contents.sqlite'))
+        namespace = DestinationIndex(self.dst)
+        if plan:
+            self.app.actions = PlannedActions(namespace, self.plan)
+        else:
+            self.app.actions = FileActions(namespace)
+
+    def move_file(self, filename, name):
+        self.app.move_file(FileInfo(filename, self.app), os.path.join(self.dst, name))
+
+    def test_duplicate_under_other_name(self):
+        self.make_app(plan=False)
+        self.move_file(self.files[0], 'x.jpg')
+        self.move_file(self.files[1], 'y.jpg')
+        self.assertEqual(os.listdir(self.dst), ['x.jpg'])
+        self.assertEqual(os.listdir(self.src), ['c.jpg'])
+
+    def test_planned_duplicate_under_other_name(self):
+        # The first file is only planned to be moved, the second one is
+        # found to be its duplicate all the same
+        self.make_app(plan=True)
+        self.move_file(self.files[0], 'x.jpg')
+        self.move_file(self.files[1], 'y.jpg')
+        self.assertEqual(self.app.actions.operations, [
+            {'op': 'move', 'src': self.files[0], 'dst': os.path.join(self.dst, 'x.jpg')},
+            {'op': 'remove', 'path': self.files[1]},
+        ])
+
+        # Once the planned file is dropped from the destination, a copy may
+        # take its place
+        self.app.remove_from_dst(os.path.join(self.dst, 'x.jpg'))
+        self.move_file(self.files[2], 'z.jpg')
+        self.assertEqual(self.app.actions.operations[2:], [
+            {'op': 'move', 'src': self.files[2], 'dst': os.path.join(self.dst, 'z.jpg')},
+        ])
+        self.assertEqual(os.listdir(self.dst), [])
+
+if __name__ == '__main__':
+    unittest.main()
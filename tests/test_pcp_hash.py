@@ -0,0 +1,134 @@
+# Perceptual hashes of a fixed set of images
+#
+# Cached hashes are only comparable with new ones while the algorithm gives
+# the same output. If these tests fail after a change of get_thumbnail(),
+# compute_pcp_hash() or an upgrade of Pillow, PCP_HASH_VERSION should be
+# increased and the expected hashes recorded again.
+
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from PIL import Image
+
+from benchmarks.corpus import make_image
+from organize.pcp_hash import calculate_pcp_hash, PCP_HASH_VERSION
+from organize.hash_index import HashIndex
+
+# name, width, height and hash of an image generated with make_image() and
+# random seed equal to its position
+CORPUS = [
+    ('a.jpg', 640, 480, 'fffffffffffffffffffffffffffffffffffefffec0fec0fec0fec0fec0fec03e'),
+    ('b.jpg', 1600, 1200, '0000000000000000000000000000000000000000ffc0ffc0ffdefffefffe0000'),
+    ('c.jpg', 333, 1001, '0000000107c30fff0fdf0fff7fff7fff7fff7ff17ff100000ffc0ffc003c0038'),
+    ('d.png', 512, 512, '00200ff80ffc0ffc0ffc0ffc0ffc0ffc0ffc0ffc0ffc002000000000000003fe'),
+    ('e.png', 97, 45, 'fffffffffc00fc00fc00f800c801c80fc80fc80fc80fd80fc00ffc00fc01ffff'),
+]
+
+# Hash of the image with seed 10, turned upright
+ROTATED = 'e01fe01fe01fe7ffe7ffe7efe7efe7efe7ff87ff060f800f800f007f00ffffff'
+
+def save_image(image, filename, exif=None):
+    kwargs = {}
+    if filename.endswith('.jpg'):
+        kwargs['quality'] = 90
+    if exif is not None:
+        kwargs['exif'] = exif.tobytes()
+    image.save(filename, **kwargs)
+
+class PcpHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_corpus(self):
+        for seed, (name, width, height, expected) in enumerate(CORPUS):
+            filename = os.path.join(self.path, name)
+            save_image(make_image(random.Random(seed), width, height), filename)
+            self.assertEqual(calculate_pcp_hash(filename), expected, name)
+
+    def test_orientation(self):
+        image = make_image(random.Random(10), 800, 600)
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        for name in ('rotated.jpg', 'rotated.png'):
+            filename = os.path.join(self.path, name)
+            save_image(image, filename, exif)
+            self.assertEqual(calculate_pcp_hash(filename), ROTATED, name)
+
+        filename = os.path.join(self.path, 'upright.png')
+        save_image(image.transpose(Image.ROTATE_270), filename)
+        self.assertEqual(calculate_pcp_hash(filename), ROTATED)
+
+    def test_broken_image(self):
+        filename = os.path.join(self.path, 'broken.jpg')
+        with open(filename, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe0 not really a JPEG')
+        self.assertIsNone(calculate_pcp_hash(filename))
+
+class HashVersionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index_filename = os.path.join(self.tmp.name, 'index.sqlite')
+        self.filename = os.path.join(self.tmp.name, 'a.jpg')
+        name, width, height, self.expected = CORPUS[0]
+        save_image(make_image(random.Random(0), width, height), self.filename)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hashes_of_other_versions_are_computed_again(self):
+        # An index created before versions were recorded, holding a hash
+        # ImageMagick computed for the file
+        index = HashIndex(self.index_filename)
+        md5 = index.get_file_hash(self.filename)
+        index.close()
+        conn = sqlite3.connect(self.index_filename)
+        conn.execute('DROP TABLE pcp_hashes')
+        conn.execute('CREATE TABLE pcp_hashes (md5 TEXT PRIMARY KEY, pcp BLOB NOT NULL)')
+        conn.execute('INSERT INTO pcp_hashes VALUES (?, ?)', (md5, bytes(32)))
+        conn.commit()
+        conn.close()
+
+        index = HashIndex(self.index_filename)
+        self.assertEqual(index.lookup_pcp_many([md5]), {})
+        self.assertEqual(index.get_pcp_hash(self.filename), self.expected)
+        self.assertEqual(index.lookup_pcp_many([md5]), {md5: self.expected})
+        row = index.conn.execute('SELECT version FROM pcp_hashes WHERE md5 = ?', (md5,)).fetchone()
+        self.assertEqual(row[0], PCP_HASH_VERSION)
+        index.close()
+
+    def test_hash_files_are_imported_once(self):
+        index = HashIndex(self.index_filename)
+        md5 = index.get_file_hash(self.filename)
+        index.close()
+        os.remove(self.index_filename)
+        with open(os.path.join(self.tmp.name, md5 + '.hash'), 'wt') as f:
+            f.write('%064x\n' % 1)
+        with open(os.path.join(self.tmp.name, 'broken.hash'), 'wt') as f:
+            f.write('not a hash')
+
+        with self.assertLogs('organize', 'WARNING'):
+            index = HashIndex(self.index_filename)
+        row = index.conn.execute('SELECT pcp, version FROM pcp_hashes WHERE md5 = ?',
+                                 (md5,)).fetchone()
+        self.assertEqual(row, (bytes(31) + b'\x01', 0))
+        # ImageMagick hashes are not comparable with ours, they are computed again
+        self.assertEqual(index.lookup_pcp_many([md5]), {})
+        self.assertEqual(index.get_pcp_hash(self.filename), self.expected)
+        index.close()
+
+        # The index exists now, files aren't imported again
+        index = HashIndex(self.index_filename)
+        self.assertEqual(index.lookup_pcp_many([md5]), {md5: self.expected})
+        index.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# Planned moves and applying them
+
+import os
+import errno
+import tempfile
+import unittest
+from unittest import mock
+
+from organize import plan
+from organize.namespace import DestinationIndex
+from organize.plan import PlannedActions, apply_group, copy_data
+
+def write_file(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+class PlannedActionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.dst = os.path.join(self.tmp.name, 'dst')
+        self.a = os.path.join(self.src, 'a.jpg')
+        self.b = os.path.join(self.src, 'b.jpg')
+        write_file(self.a, b'a')
+        write_file(self.b, b'b')
+        write_file(os.path.join(self.dst, '2019', 'taken.jpg'), b'taken')
+        self.actions = PlannedActions(DestinationIndex(self.dst),
+                                      os.path.join(self.tmp.name, 'plan.jsonl'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_remove_planned_move(self):
+        # Removing the destination of a planned move removes the source
+        # instead of moving it first
+        dst = os.path.join(self.dst, '2019', 'a.jpg')
+        self.actions.move(self.a, dst)
+        self.actions.move(self.b, os.path.join(self.dst, '2019', 'b.jpg'))
+        self.assertEqual(self.actions.physical(dst), self.a)
+        self.actions.remove(dst)
+        self.assertEqual(self.actions.operations, [
+            {'op': 'remove', 'path': self.a},
+            {'op': 'move', 'src': self.b, 'dst': os.path.join(self.dst, '2019', 'b.jpg')},
+        ])
+        self.assertFalse(self.actions.exists(dst))
+        self.assertFalse(self.actions.exists(self.a))
+        self.assertNotIn(dst, self.actions.moves)
+
+    def test_free_filename_sees_planned_moves(self):
+        taken = os.path.join(self.dst, '2019', 'taken.jpg')
+        dst = os.path.join(self.dst, '2019', 'a.jpg')
+        self.assertEqual(self.actions.get_free_filename(taken),
+                         os.path.join(self.dst, '2019', 'taken__0002.jpg'))
+        self.actions.move(self.a, dst)
+        self.assertTrue(self.actions.exists(dst))
+        free = self.actions.get_free_filename(dst)
+        self.assertEqual(free, os.path.join(self.dst, '2019', 'a__0002.jpg'))
+        self.actions.move(self.b, free)
+        self.assertEqual(self.actions.get_free_filename(dst),
+                         os.path.join(self.dst, '2019', 'a__0003.jpg'))
+
+class ApplyGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src', 'a.jpg')
+        self.dst = os.path.join(self.tmp.name, 'dst', '2019', 'a.jpg')
+        write_file(self.src, b'a' * 1000)
+        self.operations = [{'op': 'move', 'src': self.src, 'dst': self.dst}]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cross_device(self, src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src)
+
+    def test_move(self):
+        self.assertEqual(apply_group(self.operations), [self.dst])
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(read_file(self.dst), b'a' * 1000)
+
+    def test_existing_destination(self):
+        write_file(self.dst, b'other')
+        with self.assertLogs('organize', 'ERROR'):
+            self.assertEqual(apply_group(self.operations), [])
+        self.assertEqual(read_file(self.src), b'a' * 1000)
+        self.assertEqual(read_file(self.dst), b'other')
+
+    def test_cross_device(self):
+        with mock.patch.object(plan, 'rename_file', self.cross_device):
+            self.assertEqual(apply_group(self.operations), [self.dst])
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(read_file(self.dst), b'a' * 1000)
+
+    def test_cross_device_size_differs(self):
+        # The source is kept if its copy turns out shorter
+        def copy_file(src, dst):
+            write_file(dst, b'a' * 10)
+
+        with mock.patch.object(plan, 'rename_file', self.cross_device), \
+                mock.patch.object(plan, 'copy_file', copy_file), \
+                self.assertLogs('organize', 'ERROR'):
+            apply_group(self.operations)
+        self.assertEqual(read_file(self.src), b'a' * 1000)
+
+class CopyDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src.jpg')
+        self.dst = os.path.join(self.tmp.name, 'dst.jpg')
+        self.data = os.urandom(100000)
+        write_file(self.src, self.data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def copy(self):
+        with open(self.src, 'rb') as fsrc, open(self.dst, 'xb') as fdst:
+            copy_data(fsrc, fdst)
+
+    def test_copy(self):
+        self.copy()
+        self.assertEqual(read_file(self.dst), self.data)
+
+    def test_partial_copy_in_kernel(self):
+        # The kernel copies a part of the file only, the rest is copied in
+        # user space from where it stopped
+        calls = []
+
+        def copy_file_range(src, dst, count):
+            calls.append(count)
+            if len(calls) > 1:
+                return 0
+            return os.write(dst, os.read(src, 1000))
+
+        def sendfile(dst, src, offset, count):
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+
+        with mock.patch('os.copy_file_range', copy_file_range, create=True), \
+                mock.patch('os.sendfile', sendfile):
+            self.copy()
+        self.assertEqual(calls, [100000, 99000])
+        self.assertEqual(read_file(self.dst), self.data)
+
+    def test_short_copy(self):
+        with mock.patch('os.copy_file_range', mock.Mock(return_value=0), create=True), \
+                mock.patch('os.sendfile', mock.Mock(return_value=0)), \
+                mock.patch('shutil.copyfileobj'):
+            with self.assertRaises(OSError):
+                self.copy()
+
+if __name__ == '__main__':
+    unittest.main()
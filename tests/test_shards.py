@@ -0,0 +1,169 @@
+# Sharded duplicate search over folders of several local "nodes"
+
+import os
+import shutil
+import random
+import tempfile
+import unittest
+
+from benchmarks.corpus import make_image
+from organize.hash_index import HashIndex
+from organize.hasharray import popcount
+from organize.shards import Shard, ShardWriter, build_shard, sort_external, \
+    find_exact_duplicates, find_near_duplicates
+
+def write_file(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def get_paths(records):
+    return sorted((node, os.path.relpath(path)) for md5, size, pcp, node, path in records)
+
+class SortExternalTest(unittest.TestCase):
+
+    def test_runs(self):
+        items = [random.Random(i).randint(0, 1000) for i in range(1000)]
+        self.assertEqual(list(sort_external(items, run_size=64)), sorted(items))
+        self.assertEqual(list(sort_external(items, key=lambda item: -item, run_size=64)),
+                         sorted(items, reverse=True))
+        self.assertEqual(list(sort_external([], run_size=64)), [])
+
+class ShardsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.index = HashIndex('index.sqlite')
+
+        # node1 has two folders, node2 one
+        image = make_image(random.Random(1), 800, 600)
+        os.makedirs('node1/photos')
+        os.makedirs('node1/archive')
+        os.makedirs('node2/photos')
+        image.save('node1/photos/a.jpg', quality=90)
+        image.resize((400, 300)).save('node1/archive/a_small.jpg', quality=75)
+        shutil.copyfile('node1/photos/a.jpg', 'node2/photos/a_copy.jpg')
+        make_image(random.Random(101), 800, 600).save('node2/photos/b.jpg', quality=90)
+        write_file('node1/archive/notes.txt', b'notes')
+        write_file('node2/photos/notes.txt', b'notes')
+        write_file('node2/photos/other.txt', b'other notes')
+
+        self.shards = []
+        for node, paths in (('node1', ['node1/photos', 'node1/archive']),
+                            ('node2', ['node2/photos'])):
+            build_shard(paths, node, '%s.shard' % node, self.index)
+            self.shards.append(Shard('%s.shard' % node))
+
+    def tearDown(self):
+        self.index.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_build(self):
+        records = list(self.shards[0])
+        self.assertEqual(len(records), 3)
+        self.assertEqual([record[0] for record in records], sorted(record[0] for record in records))
+        self.assertTrue(all(record[3] == 'node1' for record in records))
+        self.assertTrue(all(os.path.isabs(record[4]) for record in records))
+        for md5, size, pcp, node, path in records:
+            self.assertEqual(size, os.path.getsize(path))
+            self.assertEqual(pcp is None, path.endswith('.txt'))
+
+    def test_exact_duplicates(self):
+        groups = sorted(get_paths(records) for records in find_exact_duplicates(self.shards))
+        self.assertEqual(groups, [
+            [('node1', 'node1/archive/notes.txt'), ('node2', 'node2/photos/notes.txt')],
+            [('node1', 'node1/photos/a.jpg'), ('node2', 'node2/photos/a_copy.jpg')],
+        ])
+
+    def test_near_duplicates(self):
+        clusters = [get_paths(records) for records in find_near_duplicates(self.shards, 4)]
+        self.assertEqual(clusters, [
+            [('node1', 'node1/archive/a_small.jpg'), ('node1', 'node1/photos/a.jpg'),
+             ('node2', 'node2/photos/a_copy.jpg')],
+        ])
+        self.assertEqual(list(find_near_duplicates(self.shards, 0)), [])
+
+    def test_truncated(self):
+        with open('node1.shard', 'r+b') as f:
+            f.truncate(os.path.getsize('node1.shard') - 1)
+        with self.assertRaises(ValueError):
+            list(Shard('node1.shard'))
+
+class NearDuplicatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_shard(self, hashes):
+        # Returns shard of files with the given perceptual hashes
+        filename = os.path.join(self.tmp.name, 'node.shard')
+        writer = ShardWriter(filename, 'node')
+        for i, pcp in sorted(enumerate(hashes), key=lambda item: '%032x' % item[0]):
+            writer.write('%032x' % i, 100, '%064x' % pcp, '/photos/%d.jpg' % i)
+        writer.close()
+        return Shard(filename)
+
+    def get_clusters(self, clusters):
+        return sorted(sorted(int(path[len('/photos/'):-len('.jpg')])
+                             for md5, size, pcp, node, path in cluster)
+                      for cluster in clusters)
+
+    def brute_force(self, hashes, max_distance):
+        parent = list(range(len(hashes)))
+
+        def find(i):
+            while parent[i] != i:
+                i = parent[i]
+            return i
+
+        for i in range(len(hashes)):
+            for j in range(i):
+                if popcount(hashes[i] ^ hashes[j]) <= max_distance:
+                    parent[find(i)] = find(j)
+        clusters = {}
+        for i in range(len(hashes)):
+            clusters.setdefault(find(i), []).append(i)
+        return sorted(c for c in clusters.values() if len(c) > 1)
+
+    def test_same_as_brute_force(self):
+        rng = random.Random(1)
+        hashes = []
+        for i in range(200):
+            if hashes and rng.random() < 0.5:
+                # A near duplicate of one of the previous images
+                value = rng.choice(hashes)
+                for bit in rng.sample(range(256), rng.randint(0, 6)):
+                    value ^= 1 << bit
+            else:
+                value = rng.getrandbits(256)
+            hashes.append(value)
+
+        shard = self.write_shard(hashes)
+        for max_distance in (0, 2, 4):
+            self.assertEqual(self.get_clusters(find_near_duplicates([shard], max_distance)),
+                             self.brute_force(hashes, max_distance))
+
+    def test_crowded_chunk(self):
+        # All images share every chunk, each one is compared with the 3
+        # images with the closest hashes only, equal hashes are still found
+        hashes = [1] * 30 + [3] * 30
+        shard = self.write_shard(hashes)
+        with self.assertLogs('organize', 'WARNING'):
+            clusters = self.get_clusters(find_near_duplicates([shard], 0, window=3))
+        self.assertEqual(clusters, [list(range(30)), list(range(30, 60))])
+
+    def test_max_distance(self):
+        shard = self.write_shard([1, 3])
+        for max_distance in (-1, 256, 1000):
+            with self.assertRaises(ValueError):
+                list(find_near_duplicates([shard], max_distance))
+        self.assertEqual(self.get_clusters(find_near_duplicates([shard], 255)), [[0, 1]])
+
+if __name__ == '__main__':
+    unittest.main()
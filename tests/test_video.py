@@ -0,0 +1,112 @@
+# Creation time of MP4/MOV videos read from their boxes
+
+import os
+import struct
+import tempfile
+import unittest
+from datetime import datetime as dt
+
+from organize.video import read_creation_time, read_meta, QUICKTIME_EPOCH_OFFSET, \
+    CREATION_DATE_KEY
+
+# 2019-05-01 12:30:15 UTC
+TIMESTAMP = 1556713815
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+def mvhd(created, version=0):
+    if version == 1:
+        payload = struct.pack('>B3xQQIQ', 1, created, created, 1000, 5000)
+    else:
+        payload = struct.pack('>B3xIIII', 0, created, created, 1000, 5000)
+    return box(b'mvhd', payload + bytes(80))
+
+def keys(names, count=None):
+    entries = b''.join(struct.pack('>I4s', 8 + len(name), b'mdta') + name for name in names)
+    return box(b'keys', struct.pack('>4xI', len(names) if count is None else count) + entries)
+
+def ilst(values):
+    # values is {key index: value}
+    items = b''
+    for index, value in sorted(values.items()):
+        data = box(b'data', struct.pack('>II', 1, 0) + value)
+        items += struct.pack('>II', 8 + len(data), index) + data
+    return box(b'ilst', items)
+
+def meta(*boxes):
+    # QuickTime meta, which is not a full box
+    return box(b'meta', b''.join(boxes))
+
+def mp4(*moov):
+    return box(b'ftyp', b'isom\0\0\x02\0isomiso2mp41') + box(b'moov', b''.join(moov)) + \
+           box(b'mdat', bytes(1000))
+
+class VideoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'clip.mp4')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, data):
+        with open(self.filename, 'wb') as f:
+            f.write(data)
+        return read_creation_time(self.filename)
+
+    def test_mvhd(self):
+        expected = dt.fromtimestamp(TIMESTAMP)
+        for version in (0, 1):
+            self.assertEqual(self.read(mp4(mvhd(TIMESTAMP + QUICKTIME_EPOCH_OFFSET, version))),
+                             expected, version)
+
+    def test_mvhd_unset(self):
+        self.assertIsNone(self.read(mp4(mvhd(0))))
+        # Devices without a clock start at the QuickTime or the Unix epoch
+        self.assertIsNone(self.read(mp4(mvhd(QUICKTIME_EPOCH_OFFSET + 3600))))
+
+    def test_mvhd_out_of_range(self):
+        self.assertIsNone(self.read(mp4(mvhd(2 ** 40, 1))))
+        self.assertIsNone(self.read(mp4(mvhd(2 ** 64 - 1, 1))))
+
+    def test_creation_date(self):
+        # The date of the place the video was taken wins over mvhd, which is UTC
+        data = mp4(mvhd(TIMESTAMP + QUICKTIME_EPOCH_OFFSET),
+                   meta(keys([b'com.apple.quicktime.make', CREATION_DATE_KEY]),
+                        ilst({1: b'Apple', 2: b'2019-05-01T15:30:15+0300'})))
+        self.assertEqual(self.read(data), dt(2019, 5, 1, 15, 30, 15))
+
+    def test_creation_date_with_broken_mvhd(self):
+        data = mp4(mvhd(2 ** 40, 1),
+                   meta(keys([CREATION_DATE_KEY]), ilst({1: b'2019-05-01T15:30:15+0300'})))
+        self.assertEqual(self.read(data), dt(2019, 5, 1, 15, 30, 15))
+
+    def test_user_data(self):
+        day = box(b'\xa9day', struct.pack('>HH', 24, 0) + b'2018-02-03T04:05:06+0100')
+        self.assertEqual(self.read(mp4(mvhd(0), box(b'udta', day))), dt(2018, 2, 3, 4, 5, 6))
+
+    def test_truncated(self):
+        data = mp4(mvhd(TIMESTAMP + QUICKTIME_EPOCH_OFFSET))
+        for size in (0, 4, 20, 40, 60):
+            self.assertIsNone(self.read(data[:size]), size)
+
+    def test_invalid_box_size(self):
+        data = box(b'ftyp', b'isom') + struct.pack('>I4s', 4, b'moov') + bytes(100)
+        self.assertIsNone(self.read(data))
+
+    def test_corrupt_keys(self):
+        # A huge number of keys of size 0 ends at the end of the box
+        self.assertIsNone(read_meta(meta(keys([], count=2 ** 32 - 1) + bytes(64))[8:]))
+        payload = keys([CREATION_DATE_KEY])
+        # The key is longer than its box
+        payload = payload[:16] + struct.pack('>I', 1000) + payload[20:]
+        self.assertIsNone(read_meta(meta(payload, ilst({1: b'2019-05-01T15:30:15'}))[8:]))
+
+    def test_corrupt_ilst(self):
+        data = meta(keys([CREATION_DATE_KEY]), box(b'ilst', struct.pack('>II', 0, 1) + bytes(32)))
+        self.assertIsNone(read_meta(data[8:]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+# Watching a folder by polling, which works the same way everywhere
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from organize import watch as watch_module
+from organize.watch import PollingWatcher, InotifyWatcher, Debouncer, watch, create_watcher
+
+def write_file(filename, data=b'data'):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def touch_dir(path):
+    # Directory mtime may have a coarse resolution, so it's moved forward
+    # explicitly to make the change visible
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+class PollingWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        os.mkdir(os.path.join(self.path, 'old'))
+        write_file(os.path.join(self.path, 'old', 'a.jpg'))
+        self.watcher = PollingWatcher(self.path, interval=0)
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp.cleanup()
+
+    def test_unchanged(self):
+        self.assertEqual(self.watcher.poll(0), [])
+
+    def test_new_file(self):
+        filename = os.path.join(self.path, 'old', 'b.jpg')
+        write_file(filename)
+        touch_dir(os.path.dirname(filename))
+        self.assertIn(filename, self.watcher.poll(0))
+        self.assertEqual(self.watcher.poll(0), [])
+
+    def test_new_directory(self):
+        path = os.path.join(self.path, 'new', 'nested')
+        os.makedirs(path)
+        write_file(os.path.join(path, 'c.jpg'))
+        touch_dir(self.path)
+        self.assertEqual(self.watcher.poll(0), [os.path.join(path, 'c.jpg')])
+
+        # Directories found are watched too, all files of a changed
+        # directory are reported
+        write_file(os.path.join(path, 'd.jpg'))
+        touch_dir(path)
+        self.assertEqual(sorted(self.watcher.poll(0)),
+                         [os.path.join(path, 'c.jpg'), os.path.join(path, 'd.jpg')])
+
+    def test_removed_directory(self):
+        os.remove(os.path.join(self.path, 'old', 'a.jpg'))
+        os.rmdir(os.path.join(self.path, 'old'))
+        touch_dir(self.path)
+        self.assertEqual(self.watcher.poll(0), [])
+        self.assertNotIn(os.path.join(self.path, 'old'), self.watcher.dirs)
+
+    def test_unreadable_directory(self):
+        # The directory can't be listed after its mtime has changed, it's
+        # dropped and the other ones are still watched
+        old = os.path.join(self.path, 'old')
+        scandir = os.scandir
+
+        def failing_scandir(path):
+            if path == old:
+                raise PermissionError(13, 'Permission denied', path)
+            return scandir(path)
+
+        write_file(os.path.join(old, 'b.jpg'))
+        touch_dir(old)
+        write_file(os.path.join(self.path, 'c.jpg'))
+        touch_dir(self.path)
+        with mock.patch.object(watch_module.os, 'scandir', failing_scandir), \
+                self.assertLogs('organize', 'WARNING'):
+            self.assertEqual(self.watcher.poll(0), [os.path.join(self.path, 'c.jpg')])
+        self.assertNotIn(old, self.watcher.dirs)
+
+@unittest.skipIf(not hasattr(os, 'uname') or os.uname().sysname != 'Linux', 'inotify is Linux only')
+class InotifyWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+        self.watcher = InotifyWatcher(self.path)
+
+    def tearDown(self):
+        self.watcher.close()
+        self.tmp.cleanup()
+
+    def test_new_directory(self):
+        path = os.path.join(self.path, 'new')
+        os.mkdir(path)
+        write_file(os.path.join(path, 'a.jpg'))
+        self.assertIn(os.path.join(path, 'a.jpg'), self.watcher.poll(1))
+        write_file(os.path.join(path, 'b.jpg'))
+        self.assertIn(os.path.join(path, 'b.jpg'), self.watcher.poll(1))
+
+    def test_removed_directory(self):
+        # The directory is gone by the time its creation is handled
+        path = os.path.join(self.path, 'gone')
+        os.mkdir(path)
+        os.mkdir(os.path.join(path, 'nested'))
+        with mock.patch.object(watch_module, 'scan_tree', return_value=([path], [])), \
+                self.assertLogs('organize', 'WARNING'):
+            os.rmdir(os.path.join(path, 'nested'))
+            os.rmdir(path)
+            self.assertEqual(self.watcher.poll(1), [])
+        self.assertNotIn(path, self.watcher.dirs.values())
+
+        write_file(os.path.join(self.path, 'a.jpg'))
+        self.assertIn(os.path.join(self.path, 'a.jpg'), self.watcher.poll(1))
+
+    def test_missing(self):
+        with self.assertRaises(OSError):
+            InotifyWatcher(os.path.join(self.path, 'missing'))
+
+class DebouncerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'a.jpg')
+        write_file(self.filename)
+        self.now = 100.0
+        patcher = mock.patch.object(watch_module.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_settled(self):
+        debouncer = Debouncer(settle_time=2.0)
+        debouncer.touch(self.filename)
+        self.assertEqual(debouncer.ready(), [])
+        self.now += 1.0
+        self.assertEqual(debouncer.ready(), [])
+        self.now += 1.5
+        self.assertEqual(debouncer.ready(), [self.filename])
+        self.assertEqual(len(debouncer), 0)
+
+    def test_still_written(self):
+        debouncer = Debouncer(settle_time=2.0)
+        debouncer.touch(self.filename)
+        self.assertEqual(debouncer.ready(), [])
+        self.now += 3.0
+        write_file(self.filename, b'more data')
+        self.assertEqual(debouncer.ready(), [])
+        self.now += 3.0
+        self.assertEqual(debouncer.ready(), [self.filename])
+
+    def test_removed(self):
+        debouncer = Debouncer(settle_time=2.0)
+        debouncer.touch(self.filename)
+        os.remove(self.filename)
+        self.assertEqual(debouncer.ready(), [])
+        self.assertEqual(len(debouncer), 0)
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_polling(self):
+        names = ['a.jpg', 'b.txt', 'c.jpg']
+
+        def sleep(seconds):
+            # Files arrive while the watcher waits for the first time
+            if names:
+                for name in names:
+                    write_file(os.path.join(self.path, name))
+                del names[:]
+                touch_dir(self.path)
+
+        batches = []
+        with mock.patch.object(watch_module.time, 'sleep', sleep):
+            files = watch(create_watcher(self.path, polling=True),
+                          lambda filename: filename.endswith('.jpg'), 0,
+                          lambda: batches.append(True))
+            try:
+                self.assertEqual(next(files), os.path.join(self.path, 'a.jpg'))
+                self.assertEqual(next(files), os.path.join(self.path, 'c.jpg'))
+            finally:
+                files.close()
+        self.assertEqual(batches, [True])
+
+class WatchStartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_files_arriving_before_watch(self):
+        # organize.py creates the watcher before its first pass, files
+        # arriving during the pass are reported once watching starts
+        for polling in (True, False):
+            filename = os.path.join(self.path, 'during_%s.jpg' % polling)
+            watcher = create_watcher(self.path, polling)
+            watcher.interval = 0
+            write_file(filename)
+            touch_dir(self.path)
+            files = watch(watcher, lambda filename: True, 0)
+            try:
+                self.assertEqual(next(files), filename)
+            finally:
+                files.close()
+
+if __name__ == '__main__':
+    unittest.main()